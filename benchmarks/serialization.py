@@ -0,0 +1,71 @@
+"""
+Rows/sec for the list endpoint serialization paths.
+
+    $ python benchmarks/serialization.py --rows 100000
+
+Compares loading ORM objects + serialize() + the stdlib encoder (what the list
+endpoints used to do) against selecting column tuples + the app's JSON
+provider (orjson when installed). Timed inside an app context, no HTTP.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+def timed(label, rows, func, repeat=3):
+    best = min(_once(func) for _ in range(repeat))
+    print(f"{label:<44}{rows / best:>14,.0f} rows/s")
+
+def _once(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
+
+    import json
+    from sqlalchemy import insert
+    from app import create_app
+    from models import db, People
+
+    app = create_app()
+
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.session.execute(insert(People), [{"name": f"person{i}", "height": 170, "mass": 70} for i in range(args.rows)])
+        db.session.commit()
+
+        def orm_stdlib():
+            db.session.expunge_all()
+            people = People.query.order_by(People.id).all()
+            json.dumps({"people": [person.serialize() for person in people]}, sort_keys=True)
+
+        def orm_provider():
+            db.session.expunge_all()
+            people = People.query.order_by(People.id).all()
+            app.json.dumps({"people": [person.serialize() for person in people]})
+
+        def tuples_provider():
+            rows = People.query.with_entities(*[getattr(People, name) for name in People.public_fields])
+            app.json.dumps({"people": [row._asdict() for row in rows.order_by(People.id)]})
+
+        provider = getattr(app.json, "inner", app.json)
+        print(f"{args.rows} rows, JSON provider: {type(provider).__name__}")
+        timed("ORM objects + serialize() + stdlib json", args.rows, orm_stdlib)
+        timed("ORM objects + serialize() + app provider", args.rows, orm_provider)
+        timed("column tuples + app provider", args.rows, tuples_provider)
+
+
+if __name__ == "__main__":
+    main()
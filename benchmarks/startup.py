@@ -0,0 +1,158 @@
+"""
+Cold start of a worker: how long a fresh process takes to import src/app.py,
+build the app and answer its first request.
+
+    $ python benchmarks/startup.py
+    $ python benchmarks/startup.py --runs 10 --top 15
+
+Every measurement is a new Python process, so nothing is warm but the OS file
+cache. Three setups are compared:
+
+    eager       Flask-Admin and Flask-Migrate set up while the app is built (how
+                app.py used to start)
+    lazy-admin  the default, /admin is built by its first request
+    no-admin    ADMIN_ENABLED=0
+
+For each it reports the median import, create_app() and first GET /people times,
+the first GET /admin/ where there is one, and how many modules were loaded by
+the first request. The slowest of app.py's own imports come from
+`python -X importtime`. Results are written to benchmarks/results/ like routes.py.
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+SRC = os.path.join(ROOT, "src")
+
+PROBE = """
+import os, sys, time, json
+started = time.perf_counter()
+sys.path.insert(0, {src!r})
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+if os.environ.get("STARTUP_EAGER") == "1":
+    from flask_migrate import Migrate
+    from admin import setup_admin
+    from models import db
+    Migrate(app, db)
+    setup_admin(app)
+created = time.perf_counter()
+client = app.test_client()
+assert client.get("/people").status_code == 200
+first_request = time.perf_counter()
+modules = len(sys.modules)
+admin = None
+if os.environ.get("STARTUP_EAGER") == "1" or app.config["ADMIN_ENABLED"]:
+    assert client.get("/admin/").status_code == 200
+    admin = (time.perf_counter() - first_request) * 1000
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (first_request - created) * 1000,
+    "ready_ms": (first_request - started) * 1000,
+    "first_admin_ms": admin,
+    "modules": modules,
+}}))
+"""
+
+SETUPS = (
+    ("eager", {"ADMIN_ENABLED": "0", "STARTUP_EAGER": "1"}),
+    ("lazy-admin", {"ADMIN_ENABLED": "1"}),
+    ("no-admin", {"ADMIN_ENABLED": "0"}),
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="processes per setup")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--output", help="defaults to benchmarks/results/startup-<commit>-<timestamp>.json")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def probe(env):
+    output = subprocess.check_output([sys.executable, "-c", PROBE.format(src=SRC)], env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median(runs, key):
+    values = [run[key] for run in runs if run[key] is not None]
+    return round(statistics.median(values), 1) if values else None
+
+
+def slowest_imports(env, top):
+    """Modules imported directly by app.py, by cumulative import time, from -X importtime's stderr."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {SRC!r}); import app"],
+                            env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # each level of nesting indents the name by two more spaces, app's own imports are one level down
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            modules.append((name.strip(), int(cumulative) / 1000))
+    modules.sort(key=lambda item: -item[1])
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for name, ms in modules[:top]]
+
+
+def main():
+    args = parse_args()
+    db_file = os.path.join(tempfile.mkdtemp(), "startup.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_file}")
+    subprocess.check_call([sys.executable, "-c", (
+        f"import sys; sys.path.insert(0, {SRC!r}); from app import create_app; from models import db\n"
+        "app = create_app()\nwith app.app_context(): db.create_all(bind_key=None)"
+    )], env=env)
+
+    results = {}
+    print(f"{'setup':<12}{'import':>10}{'create':>10}{'1st req':>10}{'ready':>10}{'1st admin':>11}{'modules':>9}")
+    for name, overrides in SETUPS:
+        runs = [probe(dict(env, **overrides)) for _ in range(args.runs)]
+        results[name] = {key: median(runs, key) for key in runs[0]}
+        row = results[name]
+        admin = f"{row['first_admin_ms']:.1f}" if row["first_admin_ms"] is not None else "-"
+        print(f"{name:<12}{row['import_ms']:>10.1f}{row['create_app_ms']:>10.1f}{row['first_request_ms']:>10.1f}"
+              f"{row['ready_ms']:>10.1f}{admin:>11}{row['modules']:>9.0f}")
+    print("(ms, median of {} processes)".format(args.runs))
+
+    imports = slowest_imports(env, args.top)
+    print("\nslowest imports of src/app.py (cumulative ms)")
+    for entry in imports:
+        print(f"  {entry['module']:<40}{entry['cumulative_ms']:>10.1f}")
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"startup-{git_commit()}-{stamp}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump({
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": stamp,
+                "python": platform.python_version(),
+                "runs": args.runs,
+            },
+            "setups": results,
+            "slowest_imports": imports,
+        }, handle, indent=2)
+    print(f"\nresults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
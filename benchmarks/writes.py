@@ -0,0 +1,77 @@
+"""
+Requests/sec and SQL statements per request for the single-row POST handlers.
+
+    $ python benchmarks/writes.py --requests 2000
+    $ python benchmarks/writes.py --requests 2000 --write-behind
+
+Runs against a fresh SQLite file through the Flask test client, so numbers
+measure the handler + ORM path rather than network or gunicorn overhead.
+--write-behind queues the favorite writes (src/writebehind.py) and reports the
+drain that applies them afterwards, with its commits to the database.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--write-behind", action="store_true", help="FAVORITES_WRITE_BEHIND=1")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    if args.write_behind:
+        os.environ["FAVORITES_WRITE_BEHIND"] = "1"
+        os.environ["WRITE_BEHIND_JOURNAL"] = os.path.join(directory, "journal.db")
+        os.environ["WRITE_BEHIND_MAX_PENDING"] = str(2 * args.requests)
+    # every request comes from the same client
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+    from sqlalchemy import event
+    from app import create_app
+    from models import db
+    from writebehind import favorites_queue
+
+    app = create_app()
+
+    statements, commits = [0], [0]
+    with app.app_context():
+        db.create_all()
+        event.listen(db.engine, "before_cursor_execute", lambda *_: statements.__setitem__(0, statements[0] + 1))
+        event.listen(db.engine, "commit", lambda *_: commits.__setitem__(0, commits[0] + 1))
+    client = app.test_client()
+    n = args.requests
+
+    cases = [
+        ("POST /users", "/users", lambda i: {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x"}),
+        ("POST /people", "/people", lambda i: {"name": f"person{i}", "height": 170, "mass": 70}),
+        ("POST /planets", "/planets", lambda i: {"name": f"planet{i}", "orbital_period": 300, "population": 1000}),
+        ("POST /favorite/people", "/favorite/people", lambda i: {"user_id": i + 1, "people_id": i + 1}),
+        ("POST /favorite/planets", "/favorite/planets", lambda i: {"user_id": i + 1, "planet_id": i + 1}),
+    ]
+    print(f"{'endpoint':<26}{'req/s':>10}{'sql/req':>10}{'commits':>10}")
+    for label, url, make_body in cases:
+        statements[0] = commits[0] = 0
+        started = time.perf_counter()
+        for i in range(n):
+            response = client.post(url, json=make_body(i))
+            assert response.status_code in (200, 201, 202), response.get_data(as_text=True)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<26}{n / elapsed:>10.0f}{statements[0] / n:>10.1f}{commits[0]:>10}")
+    if args.write_behind:
+        statements[0] = commits[0] = 0
+        pending = favorites_queue.pending()
+        started = time.perf_counter()
+        favorites_queue.drain()
+        elapsed = time.perf_counter() - started
+        print(f"{'drain':<26}{pending / elapsed:>10.0f}{statements[0] / pending:>10.1f}{commits[0]:>10}")
+
+
+if __name__ == "__main__":
+    main()
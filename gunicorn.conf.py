@@ -0,0 +1,9 @@
+"""
+gunicorn settings, read from the directory gunicorn is started in (the Procfile and render.yaml start it from here).
+"""
+
+
+def worker_exit(server, worker):
+    # apply queued favorite changes before the worker goes away, see src/writebehind.py
+    from writebehind import favorites_queue
+    favorites_queue.drain()
@@ -0,0 +1,41 @@
+"""deduplicate favorites and make (user_id, item_id) unique
+
+Revision ID: 3a9f1c2d7e85
+Revises: c47a2e90d5f3
+Create Date: 2026-10-18 16:02:17.504391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9f1c2d7e85'
+down_revision = 'c47a2e90d5f3'
+branch_labels = None
+depends_on = None
+
+FAVORITES = (
+    ('favorite__people', 'people_id', 'ix_favorite_people_user_id_people_id', 'uq_favorite_people_user_id_people_id'),
+    ('favorite__planet', 'planet_id', 'ix_favorite_planet_user_id_planet_id', 'uq_favorite_planet_user_id_planet_id'),
+)
+
+
+def upgrade():
+    for table, column, index, constraint in FAVORITES:
+        # keep the oldest row of every duplicated pair; the derived table lets MySQL read the table it deletes from
+        op.execute(
+            f"DELETE FROM {table} WHERE user_id IS NOT NULL AND {column} IS NOT NULL AND id NOT IN ("
+            f"SELECT id FROM (SELECT min(id) AS id FROM {table} GROUP BY user_id, {column}) AS keep)"
+        )
+        # the unique constraint's own index replaces the plain one on the same columns
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(index)
+            batch_op.create_unique_constraint(constraint, ['user_id', column])
+
+
+def downgrade():
+    for table, column, index, constraint in reversed(FAVORITES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(constraint, type_='unique')
+            batch_op.create_index(index, ['user_id', column], unique=False)
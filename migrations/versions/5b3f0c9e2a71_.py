@@ -0,0 +1,32 @@
+"""add composite indexes on favorites (user_id, item_id)
+
+Revision ID: 5b3f0c9e2a71
+Revises: d165d0e6d62c
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b3f0c9e2a71'
+down_revision = 'd165d0e6d62c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('favorite__people', schema=None) as batch_op:
+        batch_op.create_index('ix_favorite_people_user_id_people_id', ['user_id', 'people_id'], unique=False)
+
+    with op.batch_alter_table('favorite__planet', schema=None) as batch_op:
+        batch_op.create_index('ix_favorite_planet_user_id_planet_id', ['user_id', 'planet_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('favorite__planet', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorite_planet_user_id_planet_id')
+
+    with op.batch_alter_table('favorite__people', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorite_people_user_id_people_id')
@@ -0,0 +1,36 @@
+"""add (column, id) indexes for list filters and keyset sorting
+
+Revision ID: 8e1d4a7c6b20
+Revises: 5b3f0c9e2a71
+Create Date: 2026-10-18 13:41:05.402917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e1d4a7c6b20'
+down_revision = '5b3f0c9e2a71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.create_index('ix_people_height_id', ['height', 'id'], unique=False)
+        batch_op.create_index('ix_people_mass_id', ['mass', 'id'], unique=False)
+
+    with op.batch_alter_table('planets', schema=None) as batch_op:
+        batch_op.create_index('ix_planets_orbital_period_id', ['orbital_period', 'id'], unique=False)
+        batch_op.create_index('ix_planets_population_id', ['population', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('planets', schema=None) as batch_op:
+        batch_op.drop_index('ix_planets_population_id')
+        batch_op.drop_index('ix_planets_orbital_period_id')
+
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.drop_index('ix_people_mass_id')
+        batch_op.drop_index('ix_people_height_id')
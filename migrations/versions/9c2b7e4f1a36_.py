@@ -0,0 +1,40 @@
+"""add favorite_count to people and planets, backfilled from the favorites tables
+
+Revision ID: 9c2b7e4f1a36
+Revises: 3a9f1c2d7e85
+Create Date: 2026-10-18 17:21:44.902615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2b7e4f1a36'
+down_revision = '3a9f1c2d7e85'
+branch_labels = None
+depends_on = None
+
+COUNTED = (
+    ('people', 'favorite__people', 'people_id', 'ix_people_favorite_count_id'),
+    ('planets', 'favorite__planet', 'planet_id', 'ix_planets_favorite_count_id'),
+)
+
+
+def upgrade():
+    for table, favorites, column, index in COUNTED:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('favorite_count', sa.Integer(), nullable=False, server_default='0'))
+        op.execute(
+            f"UPDATE {table} SET favorite_count = "
+            f"(SELECT count(*) FROM {favorites} WHERE {favorites}.{column} = {table}.id)"
+        )
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(index, ['favorite_count', 'id'], unique=False)
+
+
+def downgrade():
+    for table, favorites, column, index in reversed(COUNTED):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(index)
+            batch_op.drop_column('favorite_count')
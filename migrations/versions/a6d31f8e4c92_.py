@@ -0,0 +1,37 @@
+"""row_version and updated_at on user, for the ETags of the user routes
+
+Revision ID: a6d31f8e4c92
+Revises: f2c8d4a61b07
+Create Date: 2026-10-18 22:14:09.682311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d31f8e4c92'
+down_revision = 'f2c8d4a61b07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the users already there are version 1, below anything written from here on
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('row_version', sa.BigInteger(), nullable=False, server_default='1'))
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # built rather than written out, "user" needs quoting and each database quotes it its own way
+    op.execute(sa.table('user', sa.column('updated_at')).update().values(updated_at=sa.func.now()))
+    # the app stamps both columns itself from here on
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('row_version', existing_type=sa.BigInteger(), server_default=None)
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index('ix_user_row_version_id', ['row_version', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_row_version_id')
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('row_version')
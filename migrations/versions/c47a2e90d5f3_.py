@@ -0,0 +1,32 @@
+"""add pg_trgm GIN indexes on people.name and planets.name (Postgres only)
+
+Revision ID: c47a2e90d5f3
+Revises: 8e1d4a7c6b20
+Create Date: 2026-10-18 14:26:51.730142
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a2e90d5f3'
+down_revision = '8e1d4a7c6b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # /search uses these on Postgres, other databases use the in-process index in src/search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_people_name_trgm ON people USING gin (name gin_trgm_ops)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_planets_name_trgm ON planets USING gin (name gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('DROP INDEX IF EXISTS ix_planets_name_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_people_name_trgm')
@@ -0,0 +1,61 @@
+"""row_version and updated_at on people, planets and favorites, soft-deleted favorites, change_counter
+
+Revision ID: e4b7a2c9d158
+Revises: 9c2b7e4f1a36
+Create Date: 2026-10-18 18:40:12.318027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7a2c9d158'
+down_revision = '9c2b7e4f1a36'
+branch_labels = None
+depends_on = None
+
+VERSIONED = (
+    ('people', 'ix_people_row_version_id'),
+    ('planets', 'ix_planets_row_version_id'),
+    ('favorite__people', 'ix_favorite_people_row_version_id'),
+    ('favorite__planet', 'ix_favorite_planet_row_version_id'),
+)
+SOFT_DELETED = ('favorite__people', 'favorite__planet')
+
+
+def upgrade():
+    op.create_table('change_counter',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('purged_version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # the rows already there are version 1, the first write gets 2
+    op.execute("INSERT INTO change_counter (id, version, purged_version) VALUES (1, 1, 0)")
+    for table, index in VERSIONED:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('row_version', sa.BigInteger(), nullable=False, server_default='1'))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+            if table in SOFT_DELETED:
+                batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        op.execute(f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP")
+        # the app stamps both columns itself from here on
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('row_version', existing_type=sa.BigInteger(), server_default=None)
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+            batch_op.create_index(index, ['row_version', 'id'], unique=False)
+
+
+def downgrade():
+    for table, index in reversed(VERSIONED):
+        if table in SOFT_DELETED:
+            # tombstones are favorites that were removed
+            op.execute(f"DELETE FROM {table} WHERE deleted_at IS NOT NULL")
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(index)
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('row_version')
+            if table in SOFT_DELETED:
+                batch_op.drop_column('deleted_at')
+    op.drop_table('change_counter')
@@ -0,0 +1,37 @@
+"""change_counter.deleted_version; row versions are stamped inline instead of from the locked counter
+
+Revision ID: f2c8d4a61b07
+Revises: e4b7a2c9d158
+Create Date: 2026-10-18 21:05:37.511840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8d4a61b07'
+down_revision = 'e4b7a2c9d158'
+branch_labels = None
+depends_on = None
+
+VERSIONED = ('people', 'planets', 'favorite__people', 'favorite__planet')
+
+
+def upgrade():
+    # change_counter.version stays as it is: on Postgres it is now added to transaction ids, so the
+    # versions written from here on still come after every version already handed out
+    with op.batch_alter_table('change_counter', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_version', sa.BigInteger(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    # back to handing out versions from the counter: carry on from the highest one written since
+    latest = op.get_bind().execute(sa.text(
+        " UNION ALL ".join(f"SELECT max(row_version) AS version FROM {table}" for table in VERSIONED)
+    )).scalars().all()
+    highest = max([version for version in latest if version is not None], default=0)
+    op.execute(sa.text("UPDATE change_counter SET version = :version WHERE id = 1 AND version < :version")
+               .bindparams(version=highest))
+    with op.batch_alter_table('change_counter', schema=None) as batch_op:
+        batch_op.drop_column('deleted_version')
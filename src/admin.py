@@ -1,20 +1,261 @@
+"""
+Flask-Admin views that stay fast on large tables.
+
+The stock ModelView runs COUNT(*) over the whole table for every list page, pages
+with OFFSET, searches with ILIKE '%term%' over any column and builds CSV exports
+in memory. KeysetModelView instead:
+
+- shows an estimated row count (pg_class.reltuples on Postgres, TABLE_ROWS on
+  MySQL, the highest id elsewhere) under a previous/next pager, never COUNT(*)
+- pages on (sort column, id) with utils.ListQuery, the < and > links carry the
+  edge rows of the current page as ?after= / ?before= cursors, so every page is
+  an index range scan however deep it is
+- only sorts and searches by columns an index leads with: text columns match by
+  prefix, integer columns by equality
+- joinedloads the related rows it lists, and the create/edit forms look them up
+  over ajax instead of loading every row into a <select>
+- streams CSV exports in keyset batches of ADMIN_EXPORT_BATCH_SIZE rows
+
+Creating, editing or deleting a person or planet drops its cached responses and
+updates the name search index, like the API's write routes.
+
+Deleting a favorite sets its deleted_at like the API's DELETE routes, so the removal
+shows in GET /changes and the person's or planet's favorite_count goes down.
+"""
 import os
+from flask import g, request, flash
 from flask_admin import Admin
-from models import db, User, Favorite_People, Favorite_Planet, People, Planets
+from flask_admin.babel import gettext
 from flask_admin.contrib.sqla import ModelView
+from sqlalchemy import select, func, or_, false, text, Integer
+from sqlalchemy.orm import configure_mappers
+from models import db, User, Favorite_People, Favorite_Planet, People, Planets
+from popularity import popularity, bump
+from cache import cache
+from search import name_search
+from utils import APIException, ListQuery
+
+ADMIN_EXPORT_BATCH_SIZE = int(os.getenv("ADMIN_EXPORT_BATCH_SIZE", 1000))
+CURSOR_ARGS = ("after", "before")
+
+ESTIMATES = {
+    # NULL before the first ANALYZE, -1 since Postgres 14
+    "postgresql": "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)",
+    "mysql": "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table",
+}
+
+
+def estimated_count(session, model):
+    """Roughly how many rows the table has, from the planner's statistics instead of COUNT(*)."""
+    estimate = ESTIMATES.get(session.get_bind().dialect.name)
+    if estimate is not None:
+        rows = session.execute(text(estimate), {"table": model.__tablename__}).scalar()
+        if rows is not None and rows >= 0:
+            return rows
+    # one step down the primary key index; deleted rows make it an overestimate
+    return session.execute(select(func.max(model.id))).scalar() or 0
+
+
+class KeysetModelView(ModelView):
+    list_template = "admin/keyset_list.html"
+    simple_list_pager = True
+    page_size = 50
+    can_export = True
+    export_types = ["csv"]
+    # the app stamps these
+    form_excluded_columns = ("row_version", "updated_at", "favorite_count")
+    # the response cache resource and name search kind of the model, if it has them
+    cache_resource = None
+    search_kind = None
+
+    def after_model_change(self, form, model, is_created):
+        if self.cache_resource is not None:
+            cache.invalidate(self.cache_resource, model.id)
+        if self.search_kind is not None:
+            # drops the old name of a renamed row
+            name_search.remove(self.search_kind, model.id)
+            name_search.add(self.search_kind, model.id, model.name)
+
+    def after_model_delete(self, model):
+        if self.cache_resource is not None:
+            cache.invalidate(self.cache_resource, model.id)
+        if self.search_kind is not None:
+            name_search.remove(self.search_kind, model.id)
+
+    def estimated_count(self):
+        return estimated_count(self.session, self.model)
+
+    def list_query(self, sort_column, sort_desc, search, filters):
+        """The stock query with search, filters and joinedloads but no ORDER BY or LIMIT, as a ListQuery."""
+        _, query = super().get_list(0, None, None, search, filters, execute=False, page_size=0)
+        column = self._sortable_columns.get(sort_column, self.model.id) if sort_column else self.model.id
+        return ListQuery(self.model, query, column, bool(sort_desc))
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        page_size = self.page_size if page_size is None else page_size
+        keyset = self.list_query(sort_column, sort_desc, search, filters)
+        after, before = request.args.get("after"), request.args.get("before")
+        try:
+            if page and before is not None:
+                # walk back from the first row of the next page, then put the rows in order again
+                backwards = ListQuery(self.model, keyset.statement, keyset.sort_column, not keyset.descending)
+                rows = backwards.keyset(before).limit(page_size).all()[::-1]
+            else:
+                rows = keyset.keyset(after if page else None).limit(page_size).all()
+        except APIException:
+            # a cursor from another sort order
+            rows = keyset.keyset().limit(page_size).all()
+        if rows:
+            g.admin_page_edges = (keyset.cursor(rows[0]), keyset.cursor(rows[-1]))
+        return None, rows
+
+    def _get_list_extra_args(self):
+        view_args = super()._get_list_extra_args()
+        if view_args.page and not any(name in view_args.extra_args for name in CURSOR_ARGS):
+            # there is no page N without the cursor that leads to it
+            view_args.page = 0
+        g.admin_view_args = view_args
+        return view_args
+
+    def _get_list_url(self, view_args):
+        current = g.get("admin_view_args")
+        edges = g.get("admin_page_edges")
+        # index_view passes its own view_args for return_url, keep those as they are
+        view_args = view_args.clone()
+        cursors = {name: view_args.extra_args.pop(name, None) for name in CURSOR_ARGS}
+        same_list = current is not None and all(getattr(view_args, name) == getattr(current, name) for name in
+                                                ("sort", "sort_desc", "search", "filters", "page_size"))
+        if view_args.page and same_list and edges is not None:
+            if view_args.page == current.page + 1:
+                view_args.extra_args["after"] = edges[1]
+            elif view_args.page == current.page - 1:
+                view_args.extra_args["before"] = edges[0]
+            elif view_args.page == current.page:
+                view_args.extra_args.update({name: value for name, value in cursors.items() if value is not None})
+            else:
+                view_args.page = 0
+        else:
+            # another sort, search or page size starts again from the first page
+            view_args.page = 0
+        return super()._get_list_url(view_args)
 
-def setup_admin(app):
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # the whole text is one prefix ("Luke Sky"), not words matched anywhere like the stock search
+        term = search.strip()
+        conditions = []
+        for column, _ in self._search_fields:
+            if isinstance(column.type, Integer):
+                if term.isdigit():
+                    conditions.append(column == int(term))
+            else:
+                conditions.append(column.startswith(term, autoescape=True))
+        query = query.filter(or_(*conditions) if conditions else false())
+        return query, count_query, joins, count_joins
+
+    def export_rows(self, sort_column, sort_desc, search, filters):
+        keyset = self.list_query(sort_column, sort_desc, search, filters)
+        after = None
+        while True:
+            rows = keyset.keyset(after).limit(ADMIN_EXPORT_BATCH_SIZE).all()
+            yield from rows
+            if len(rows) < ADMIN_EXPORT_BATCH_SIZE:
+                return
+            after = keyset.cursor(rows[-1])
+
+    def _export_data(self):
+        # the stock version loads every row before the first line is written
+        view_args = self._get_list_extra_args()
+        sort_column = self._get_column_by_idx(view_args.sort)
+        if sort_column is not None:
+            sort_column = sort_column[0]
+        return None, self.export_rows(sort_column, view_args.sort_desc, view_args.search, view_args.filters)
+
+
+class UserView(KeysetModelView):
+    column_exclude_list = ("password",)
+    column_export_exclude_list = ("password",)
+    column_sortable_list = ("id", "username", "email")
+    column_searchable_list = ("username", "email")
+    form_excluded_columns = KeysetModelView.form_excluded_columns + ("favorite_people", "favorite_planet")
+
+
+class PeopleView(KeysetModelView):
+    cache_resource = "people"
+    search_kind = "person"
+    column_sortable_list = ("id", "name", "height", "mass", "favorite_count")
+    column_searchable_list = ("name",)
+    form_excluded_columns = KeysetModelView.form_excluded_columns + ("favorite_people",)
+
+
+class PlanetsView(KeysetModelView):
+    cache_resource = "planets"
+    search_kind = "planet"
+    column_sortable_list = ("id", "name", "orbital_period", "population", "favorite_count")
+    column_searchable_list = ("name",)
+    form_excluded_columns = KeysetModelView.form_excluded_columns + ("favorite_planet",)
+
+
+class FavoriteView(KeysetModelView):
+    """Deleting a favorite leaves a tombstone and decrements favorite_count, like the DELETE routes."""
+    target_model = None
+    target_key = None
+
+    def delete_model(self, model):
+        try:
+            self.on_model_delete(model)
+            removed = (self.session.query(self.model).filter_by(id=model.id, deleted_at=None)
+                       .update({"deleted_at": func.now()}, synchronize_session=False))
+            target_id = getattr(model, self.target_key)
+            if removed:
+                bump(self.target_model, target_id, -removed)
+            self.session.commit()
+        except Exception as ex:
+            if not self.handle_view_exception(ex):
+                flash(gettext("Failed to delete record. %(error)s", error=str(ex)), "error")
+            self.session.rollback()
+            return False
+        if removed:
+            popularity.changed(self.target_model, target_id, -removed)
+        self.after_model_delete(model)
+        return True
+
+
+class FavoritePeopleView(FavoriteView):
+    target_model = People
+    target_key = "people_id"
+    # listed many-to-one relations are joinedloaded with the page (column_auto_select_related)
+    column_list = ("id", "user_favorite_people", "favorite_people", "row_version", "updated_at", "deleted_at")
+    column_labels = {"user_favorite_people": "User", "favorite_people": "Person"}
+    column_sortable_list = ("id", "row_version")
+    # the unique (user_id, people_id) index leads with user_id
+    column_searchable_list = ("user_id",)
+    form_ajax_refs = {"user_favorite_people": {"fields": ("username",)}, "favorite_people": {"fields": ("name",)}}
+
+
+class FavoritePlanetView(FavoriteView):
+    target_model = Planets
+    target_key = "planet_id"
+    column_list = ("id", "user_favorite_planet", "favorite_planet", "row_version", "updated_at", "deleted_at")
+    column_labels = {"user_favorite_planet": "User", "favorite_planet": "Planet"}
+    column_sortable_list = ("id", "row_version")
+    column_searchable_list = ("user_id",)
+    form_ajax_refs = {"user_favorite_planet": {"fields": ("username",)}, "favorite_planet": {"fields": ("name",)}}
+
+
+def setup_admin(app, url='/admin'):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3', url=url)
+    # the favorites views name backref attributes, which exist once the mappers are configured
+    configure_mappers()
+
 
-    
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Favorite_People, db.session))
-    admin.add_view(ModelView(Favorite_Planet, db.session))
-    admin.add_view(ModelView(People, db.session))
-    admin.add_view(ModelView(Planets, db.session))
-
-    # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(FavoritePeopleView(Favorite_People, db.session))
+    admin.add_view(FavoritePlanetView(Favorite_Planet, db.session))
+    admin.add_view(PeopleView(People, db.session))
+    admin.add_view(PlanetsView(Planets, db.session))
+
+    # You can duplicate that line to add mew models, KeysetModelView keeps big tables usable
+    # admin.add_view(KeysetModelView(YourModelName, db.session))
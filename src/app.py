@@ -2,47 +2,142 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Flask, Blueprint, request, jsonify, current_app
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import selectinload
+from utils import (APIException, generate_sitemap, get_page_args, wants_stream, serialize_row, ListQuery, FastJSONProvider,
+                   parse_ids, in_requested_order, MAX_PAGE_SIZE, DEFAULT_PAGE_SIZE)
+from extensions import mount_admin, migrate_cli, register_swagger
+from cache import cache, conditional, latest_version
+from compression import compression
+from metrics import metrics
+from ratelimit import limiter, list_cost, STREAM_COST
+from database import (engine_options, instrument_engine, dispose_after_fork, pool_status, replica_binds, router, read_only,
+                      insert_or_revive, inserted, revive)
+import bulk
+from search import name_search
+from popularity import popularity, bump, cli as popularity_cli
+from changes import feed, cli as changes_cli
+from writebehind import favorites_queue, ADD, REMOVE, cli as favorites_cli
 from models import db, User, Favorite_People, Favorite_Planet, People, Planets
 #from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+api = Blueprint("api", __name__)
+
+
+def create_app(config=None):
+    """
+    Builds the app without touching the database: engines are created here but
+    connect on first use, so with `gunicorn --preload` every worker opens its own.
+    """
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.url_map.strict_slashes = False
+
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_BINDS'] = replica_binds(os.getenv("DATABASE_REPLICA_URLS"))
+    app.config['ADMIN_ENABLED'] = os.getenv("ADMIN_ENABLED", "1") == "1"
+    app.config['SWAGGER_ENABLED'] = os.getenv("SWAGGER_ENABLED", "0") == "1"
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    db.init_app(app)
+    router.init_app(app)
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        instrument_engine(engine)
+    # a no-op unless something connected in the parent process, kept as the safety net for --preload
+    dispose_after_fork(engines)
+    # after_request hooks run in reverse, registered first so it compresses the final response (CORS headers and all)
+    compression.init_app(app)
+    metrics.init_app(app, engines)
+    metrics.gauge("responses_compressed_total", "Response bodies gzip/br compressed", lambda: compression.compressed)
+    metrics.gauge("compressed_bodies_reused_total", "Compressed bodies served again from the per-worker cache",
+                  lambda: compression.reused)
+    metrics.gauge("cache_hits_total", "Response cache hits", lambda: cache.hits)
+    metrics.gauge("cache_misses_total", "Response cache misses", lambda: cache.misses)
+    metrics.gauge("db_pool_checked_out", "Connections in use", lambda: pool_status(db.engine).get("checked_out", 0))
+    limiter.init_app(app)
+    metrics.gauge("rate_limited_total", "Requests answered 429 by the rate limiter", lambda: limiter.limited)
+    metrics.gauge("requests_shed_total", "Requests answered 503 over MAX_CONCURRENT_REQUESTS", lambda: limiter.shed)
+    cache.init_app(app)
+    favorites_queue.init_app(app)
+    metrics.gauge("favorites_queued_pending", "Favorite changes waiting in the write-behind journal",
+                  favorites_queue.pending)
+    metrics.gauge("favorites_queue_rejected_total", "Favorite changes answered 503 with the journal full",
+                  lambda: favorites_queue.rejected)
+    CORS(app)
+    app.register_blueprint(api)
+    if app.config['ADMIN_ENABLED']:
+        mount_admin(app)
+    if app.config['SWAGGER_ENABLED']:
+        register_swagger(app)
+    app.cli.add_command(migrate_cli)
+    app.cli.add_command(popularity_cli)
+    app.cli.add_command(changes_cli)
+    app.cli.add_command(favorites_cli)
+    return app
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+# All pool connections are busy for longer than DB_POOL_TIMEOUT, shed the request instead of queueing more
+@api.app_errorhandler(PoolTimeoutError)
+def handle_pool_timeout(error):
+    return jsonify({"error": "Database busy, try again later"}), 503, {"Retry-After": "1"}
+
+def rows_by_ids(resource, model, ids):
+    # ?ids= and the /lookup routes: one response for a whole favorites list instead of one request per item
+    rows, missing = in_requested_order(cache.rows(resource, model, ids), ids)
+    return jsonify({resource: rows, "missing": missing}), 200
+
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-     return generate_sitemap(app)
-
-@app.route('/users', methods=['GET'])
+     return generate_sitemap(current_app)
+
+@api.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache.stats()), 200
+
+@api.route('/db/pool', methods=['GET'])
+def get_pool_status():
+    return jsonify(pool_status(db.engine)), 200
+
+@api.route('/search', methods=['GET'])
+@limiter.cost(2)
+@read_only
+def search_names():
+    q = request.args.get("q", "")
+    if not q.strip():
+        return jsonify({"error": "Missing q"}), 400
+    limit, _ = get_page_args()
+    return jsonify({"query": q, "results": name_search.search(q, min(limit, 100))}), 200
+
+@api.route('/users', methods=['GET'])
+@limiter.cost(list_cost)
+@read_only
+@conditional(User)
 def get_all_users():
-    users = User.query.all()
-    serialized_users = [user.serialize() for user in users]
-    return jsonify({"users": serialized_users}), 200
-
-@app.route('/users', methods=['POST'])
+    listing = ListQuery.from_request(User)
+    if wants_stream():
+        return listing.stream(request.args.get("after"))
+    limit, after = get_page_args()
+    users, next_cursor = listing.page(limit, after)
+    serialized_users = [serialize_row(user) for user in users]
+    return jsonify({"users": serialized_users, "next": next_cursor}), 200
+
+@api.route('/users', methods=['POST'])
 def create_user():
     body = request.json
     username = body.get("username", None)
@@ -52,130 +147,210 @@ def create_user():
     if username is None or email is None or password is None:
         return jsonify({"error": "Missing values!"}), 400
     
-    email_exists = User.query.filter_by(email=email).first()
-    if email_exists is not None:
-        return jsonify({"error": "Email already in use!"}), 400
-    
     user = User(username=username, email=email, password=password)
     try:
         db.session.add(user)
         db.session.commit()
-        db.session.refresh(user)
-        return jsonify({"message": f"{user.username} created!"}), 201
-    
+        return jsonify({"message": f"{username} created!"}), 201
+
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "Username or email already in use!"}), 400
+
     except Exception as error:
         db.session.rollback()
         return jsonify({"error": f"{error}"}), 500
 
 
-@app.route('/users/favorites', methods=['GET'])
+@api.route('/users/favorites', methods=['GET'])
+@limiter.cost(STREAM_COST)
+@read_only
+@conditional(Favorite_People, Favorite_Planet)
 def get_user_favorites():
-    favorite_people = Favorite_People.query.all()
-    favorite_planets = Favorite_Planet.query.all()
+    favorite_people = Favorite_People.query.filter_by(deleted_at=None).all()
+    favorite_planets = Favorite_Planet.query.filter_by(deleted_at=None).all()
     serialized_people = [favorite_person.serialize() for favorite_person in favorite_people]
     serialized_planet = [favorite_planet.serialize() for favorite_planet in favorite_planets]
     return jsonify({"favorites": f"{serialized_people}" f"{serialized_planet}"}), 200
 
-@app.route('/favorite/people', methods=['POST'])
+def user_favorites_versions(user_id):
+    """The rows GET /users/<id>/favorites reads: the user, their favorites (removed ones too) and what those point at."""
+    user_id = int(user_id)
+    return [
+        select(User.row_version).where(User.id == user_id).scalar_subquery(),
+        latest_version(Favorite_People, Favorite_People.user_id == user_id),
+        latest_version(Favorite_Planet, Favorite_Planet.user_id == user_id),
+        latest_version(People, People.id == Favorite_People.people_id, Favorite_People.user_id == user_id,
+                       Favorite_People.deleted_at.is_(None)),
+        latest_version(Planets, Planets.id == Favorite_Planet.planet_id, Favorite_Planet.user_id == user_id,
+                       Favorite_Planet.deleted_at.is_(None)),
+    ]
+
+@api.route('/users/<int:user_id>/favorites', methods=['GET'])
+@read_only
+@conditional(versions=user_favorites_versions)
+def get_single_user_favorites(user_id):
+    # Favorites and their people/planets come back in one SELECT ... IN per collection, no per-row lazy loads
+    user = User.query.options(
+        selectinload(User.favorite_people.and_(Favorite_People.deleted_at.is_(None)))
+        .joinedload(Favorite_People.favorite_people),
+        selectinload(User.favorite_planet.and_(Favorite_Planet.deleted_at.is_(None)))
+        .joinedload(Favorite_Planet.favorite_planet)
+    ).filter_by(id=user_id).first()
+    if user is None:
+        return jsonify({"error": "User not found!"}), 404
+    return jsonify({"user_id": user.id, "favorites": user.serialize_favorites()}), 200
+
+@api.route('/favorite/people', methods=['POST'])
+@cache.idempotent
 def add_person_to_favorites():
     body = request.json
     user_id = body.get("user_id", None)
     people_id = body.get("people_id", None)
     
-    person_exists = People.query.filter_by(id=people_id)
-    if not person_exists:
-        return jsonify({"error": "Person not found!"}), 404
-    
-    user_exists = User.query.filter_by(id=user_id)
-    if not user_exists:
-        return jsonify({"error": "User not found!"}), 404
-    
     if user_id is None or people_id is None:
         return jsonify({"error": "Missing values!"}), 400
+    if favorites_queue.enabled:
+        return favorites_queue.submit("people", user_id, people_id, ADD)
     
-    favorite = Favorite_People.query.filter_by(user_id=user_id, id=people_id).first()
-    if favorite:
-        return jsonify({"message": "Person is already a favorite"}), 400
-
-    new_favorite = Favorite_People(user_id=user_id, people_id=people_id)
+    # the unique (user_id, people_id) key is the duplicate check, a repeated favorite inserts nothing
+    # and a removed one is brought back
+    statement = insert_or_revive(db.engine.dialect.name, Favorite_People, "user_id", "people_id")
     try:
-        db.session.add(new_favorite)
+        try:
+            result = db.session.execute(statement.values(user_id=user_id, people_id=people_id))
+            added = inserted(db.engine.dialect.name, result)
+        except IntegrityError:
+            # the upserts never raise on a duplicate, only the plain INSERT of other dialects does
+            db.session.rollback()
+            added = revive(Favorite_People, user_id=user_id, people_id=people_id)
+            if added is None:
+                return jsonify({"error": "User or person not found!"}), 404
+        if not added:
+            db.session.rollback()
+            return jsonify({"message": "Person is already a favorite"}), 400
+        bump(People, people_id, 1)
         db.session.commit()
-        db.session.refresh(new_favorite)
+        popularity.changed(People, people_id, 1)
         return jsonify({"message": "Person added to favorites"}), 201
         
     except Exception as error:
         db.session.rollback()
         return jsonify({"error": f"{error}"}), 500
 
-@app.route('/users/<int:user_id>/favorite/people/<int:people_id>', methods=['DELETE'])
+@api.route('/favorites/bulk', methods=['POST'])
+@limiter.cost(10)
+def add_favorites_bulk():
+    results = bulk.create_favorites(bulk.read_items())
+    body, status = bulk.report(results)
+    if body["created"]:
+        popularity.mark_stale()
+    return jsonify(body), status
+
+@api.route('/users/<int:user_id>/favorite/people/<int:people_id>', methods=['DELETE'])
 def remove_person_from_favorites(user_id, people_id):
+    if favorites_queue.enabled:
+        return favorites_queue.submit("people", user_id, people_id, REMOVE)
     
-    favorite = Favorite_People.query.filter_by(user_id=user_id, people_id=people_id).first()
     try:
-        if not favorite:
+        # a tombstone instead of a DELETE, so GET /changes can tell clients the favorite is gone
+        deleted = (Favorite_People.query.filter_by(user_id=user_id, people_id=people_id, deleted_at=None)
+                   .update({"deleted_at": func.now()}, synchronize_session=False))
+        if not deleted:
+            db.session.rollback()
             return jsonify({"error": "Person not in favorites"}), 404
-        db.session.delete(favorite)
+        bump(People, people_id, -deleted)
         db.session.commit()
+        popularity.changed(People, people_id, -deleted)
         return jsonify({"message": "Person deleted from favorites!"}), 201
         
     except Exception as error:
+        db.session.rollback()
         return jsonify({"error": f"{error}"}), 500
 
 
-@app.route('/favorite/planets', methods=['POST'])
+@api.route('/favorite/planets', methods=['POST'])
+@cache.idempotent
 def add_planet_to_favorites():
     body = request.json
     user_id = body.get("user_id", None)
     planet_id = body.get("planet_id", None)
 
-    planet_exists = Planets.query.filter_by(id=planet_id)
-    if not planet_exists:
-        return jsonify({"error": "Planet not found!"}), 404
-
-    user_exists = User.query.filter_by(id=user_id)
-    if not user_exists:
-        return jsonify({"error": "User not found!"}), 404
-
     if user_id is None or planet_id is None:
         return jsonify({"error": "Missing values!"}), 400
+    if favorites_queue.enabled:
+        return favorites_queue.submit("planets", user_id, planet_id, ADD)
     
-    favorite = Favorite_Planet.query.filter_by(user_id=user_id, id=planet_id).first()
-    if favorite:
-        return jsonify({"message": "Planet is already a favorite"}), 400
-    
-    new_favorite = Favorite_Planet(user_id=user_id, planet_id=planet_id)
+    # the unique (user_id, planet_id) key is the duplicate check, a repeated favorite inserts nothing
+    # and a removed one is brought back
+    statement = insert_or_revive(db.engine.dialect.name, Favorite_Planet, "user_id", "planet_id")
     try:
-        db.session.add(new_favorite)
+        try:
+            result = db.session.execute(statement.values(user_id=user_id, planet_id=planet_id))
+            added = inserted(db.engine.dialect.name, result)
+        except IntegrityError:
+            # the upserts never raise on a duplicate, only the plain INSERT of other dialects does
+            db.session.rollback()
+            added = revive(Favorite_Planet, user_id=user_id, planet_id=planet_id)
+            if added is None:
+                return jsonify({"error": "User or planet not found!"}), 404
+        if not added:
+            db.session.rollback()
+            return jsonify({"message": "Planet is already a favorite"}), 400
+        bump(Planets, planet_id, 1)
         db.session.commit()
-        db.session.refresh(new_favorite)
+        popularity.changed(Planets, planet_id, 1)
         return jsonify({"message": "Planet added to favorites"}), 200
 
     except Exception as error:
         db.session.rollback()
         return jsonify({"error": f"{error}"}), 500
 
-@app.route('/users/<int:user_id>/favorite/planets/<int:planet_id>', methods=['DELETE'])
+@api.route('/users/<int:user_id>/favorite/planets/<int:planet_id>', methods=['DELETE'])
 def remove_planet_from_favorites(user_id, planet_id):
+    if favorites_queue.enabled:
+        return favorites_queue.submit("planets", user_id, planet_id, REMOVE)
     
-    favorite = Favorite_Planet.query.filter_by(user_id=user_id, planet_id=planet_id).first()
     try:
-        if not favorite:
+        # a tombstone instead of a DELETE, so GET /changes can tell clients the favorite is gone
+        deleted = (Favorite_Planet.query.filter_by(user_id=user_id, planet_id=planet_id, deleted_at=None)
+                   .update({"deleted_at": func.now()}, synchronize_session=False))
+        if not deleted:
+            db.session.rollback()
             return jsonify({"error": "Planet not in favorites"}), 404
-        db.session.delete(favorite)
+        bump(Planets, planet_id, -deleted)
         db.session.commit()
+        popularity.changed(Planets, planet_id, -deleted)
         return jsonify({"message": "Planet deleted from favorites!"}), 200
         
     except Exception as error:
+        db.session.rollback()
         return jsonify({"error": f"{error}"}), 500
 
-@app.route('/people', methods=['GET'])
+@api.route('/changes', methods=['GET'])
+@limiter.cost(list_cost)
+@read_only
+def get_changes():
+    limit, _ = get_page_args()
+    return jsonify(feed(request.args.get("since"), limit)), 200
+
+@api.route('/people', methods=['GET'])
+@limiter.cost(list_cost)
+@read_only
+@cache.cached("people")
+@conditional(People)
 def get_all_people():
-    people = People.query.all()
-    serialized_people = [person.serialize() for person in people]
-    return jsonify({"people": serialized_people}), 200
-
-@app.route('/people', methods=['POST'])
+    if "ids" in request.args:
+        return rows_by_ids("people", People, parse_ids(request.args["ids"]))
+    listing = ListQuery.from_request(People)
+    if wants_stream():
+        return listing.stream(request.args.get("after"))
+    limit, after = get_page_args()
+    people, next_cursor = listing.page(limit, after)
+    serialized_people = [serialize_row(person) for person in people]
+    return jsonify({"people": serialized_people, "next": next_cursor}), 200
+
+@api.route('/people', methods=['POST'])
 def add_person():
     body = request.json
     name = body.get("name", None)
@@ -185,41 +360,81 @@ def add_person():
     if name is None or height is None or mass is None:
         return jsonify({"error": "Missing values"}), 400
 
-    person_exists = People.query.filter_by(name=name).first()
-    if person_exists is not None:
-        return jsonify({"error": f"{name} already exists!"}), 400
-
     person = People(name=name, height=height, mass=mass)
 
     try:
         db.session.add(person)
+        # flush gets the id back from the INSERT itself, so indexing it doesn't need another SELECT
+        db.session.flush()
+        person_id = person.id
         db.session.commit()
-        db.session.refresh(person)
-        return jsonify({"message": f"{person.name} created!"}), 201
-        
+        cache.invalidate("people")
+        name_search.add("person", person_id, name)
+        return jsonify({"message": f"{name} created!"}), 201
+
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": f"{name} already exists!"}), 400
+
     except Exception as error:
         db.session.rollback()
         return jsonify({"error": f"{error}"}), 500
 
-@app.route('/people/<int:id>', methods=['GET'])
+@api.route('/people/bulk', methods=['POST'])
+@limiter.cost(10)
+def add_people_bulk():
+    results = bulk.create_catalog(People, bulk.read_items(), ("name", "height", "mass"))
+    body, status = bulk.report(results)
+    if body["created"]:
+        cache.invalidate("people")
+        name_search.mark_stale()
+    return jsonify(body), status
+
+@api.route('/people/popular', methods=['GET'])
+@read_only
+def get_popular_people():
+    limit, _ = get_page_args()
+    return jsonify({"people": popularity.top(People, limit)}), 200
+
+@api.route('/people/lookup', methods=['POST'])
+@limiter.cost(1 + MAX_PAGE_SIZE // DEFAULT_PAGE_SIZE)
+@read_only
+def lookup_people():
+    body = request.get_json(silent=True) or {}
+    return rows_by_ids("people", People, parse_ids(body.get("ids")))
+
+@api.route('/people/<int:id>', methods=['GET'])
+@read_only
+@cache.cached("people")
+@conditional(People)
 def get_single_person(id):
     try:
         person = People.query.get(id)
         if person is None:
-            return jsonify({"Person not found!"}), 404
+            return jsonify({"error": "Person not found!"}), 404
         return jsonify({"person": person.serialize()}), 200
      
     except Exception as error:
         return jsonify({"error": f"{error}"}), 500
     
 
-@app.route('/planets', methods=['GET'])
+@api.route('/planets', methods=['GET'])
+@limiter.cost(list_cost)
+@read_only
+@cache.cached("planets")
+@conditional(Planets)
 def get_all_planets():
-    planets = Planets.query.all()
-    serialized_planets = [planet.serialize() for planet in planets]
-    return jsonify({"planets": serialized_planets}), 200
-
-@app.route('/planets', methods=['POST'])
+    if "ids" in request.args:
+        return rows_by_ids("planets", Planets, parse_ids(request.args["ids"]))
+    listing = ListQuery.from_request(Planets)
+    if wants_stream():
+        return listing.stream(request.args.get("after"))
+    limit, after = get_page_args()
+    planets, next_cursor = listing.page(limit, after)
+    serialized_planets = [serialize_row(planet) for planet in planets]
+    return jsonify({"planets": serialized_planets, "next": next_cursor}), 200
+
+@api.route('/planets', methods=['POST'])
 def add_planet():
     body = request.json
     name = body.get("name", None)
@@ -229,29 +444,59 @@ def add_planet():
     if name is None or orbital_period is None or population is None:
         return jsonify({"error": "Missing values"}), 400
 
-    planet_exists = Planets.query.filter_by(name=name).first()
-    if planet_exists is not None:
-        return jsonify({"error": f"{name} already exists!"}), 400
-
     planet = Planets(name=name, orbital_period=orbital_period, population=population)
 
     try:
         db.session.add(planet)
+        # flush gets the id back from the INSERT itself, so indexing it doesn't need another SELECT
+        db.session.flush()
+        planet_id = planet.id
         db.session.commit()
-        db.session.refresh(planet)
-        return jsonify({"message": f"{planet.name} created!"}), 201
-        
+        cache.invalidate("planets")
+        name_search.add("planet", planet_id, name)
+        return jsonify({"message": f"{name} created!"}), 201
+
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": f"{name} already exists!"}), 400
+
     except Exception as error:
         db.session.rollback()
         return jsonify({"error": f"{error}"}), 500
 
 
-@app.route('/planets/<int:id>', methods=['GET'])
+@api.route('/planets/bulk', methods=['POST'])
+@limiter.cost(10)
+def add_planets_bulk():
+    results = bulk.create_catalog(Planets, bulk.read_items(), ("name", "orbital_period", "population"))
+    body, status = bulk.report(results)
+    if body["created"]:
+        cache.invalidate("planets")
+        name_search.mark_stale()
+    return jsonify(body), status
+
+@api.route('/planets/popular', methods=['GET'])
+@read_only
+def get_popular_planets():
+    limit, _ = get_page_args()
+    return jsonify({"planets": popularity.top(Planets, limit)}), 200
+
+@api.route('/planets/lookup', methods=['POST'])
+@limiter.cost(1 + MAX_PAGE_SIZE // DEFAULT_PAGE_SIZE)
+@read_only
+def lookup_planets():
+    body = request.get_json(silent=True) or {}
+    return rows_by_ids("planets", Planets, parse_ids(body.get("ids")))
+
+@api.route('/planets/<int:id>', methods=['GET'])
+@read_only
+@cache.cached("planets")
+@conditional(Planets)
 def get_single_planet(id):
     try:
         planet = Planets.query.get(id)
         if planet is None:
-            return jsonify({"Planet not found!"}), 400
+            return jsonify({"error": "Planet not found!"}), 404
         return jsonify({"planet": planet.serialize()}), 200
         
     except Exception as error:
@@ -262,4 +507,4 @@ def get_single_planet(id):
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,252 @@
+"""
+Optional ASGI entry point, the async counterpart of wsgi.py:
+
+    $ uvicorn asgi:application --app-dir src --port 3000
+    $ gunicorn -k uvicorn.workers.UvicornWorker --chdir ./src asgi:application
+
+The read routes (GET /users, /people, /planets, /people/<id>, /planets/<id> and
+/users/<id>/favorites) run as coroutines on an async SQLAlchemy engine, so a
+worker keeps serving other requests while it waits on the database. They build
+the same statements as the Flask views (utils.ListQuery), return the same JSON
+and answer If-None-Match with the same ETags. Every other route and method is
+handed to the Flask app, which runs in a pool of ASGI_SYNC_WORKERS threads.
+
+The async engine uses DATABASE_URL with its async driver (postgresql+asyncpg,
+sqlite+aiosqlite) unless ASYNC_DATABASE_URL is set, sized by the same DB_POOL_*
+variables. Rate limits and the concurrency cap (ratelimit.py) apply to both
+kinds of route, and so does gzip/brotli compression (compression.py); the
+response cache, read replicas and /metrics only cover the routes served by Flask.
+"""
+import os
+import re
+import asyncio
+from urllib.parse import parse_qsl
+from a2wsgi import WSGIMiddleware
+from flask import Response
+from sqlalchemy import select
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import selectinload
+from werkzeug.datastructures import MultiDict, MIMEAccept, Accept
+from werkzeug.http import parse_accept_header, parse_etags
+from app import create_app, user_favorites_versions
+from cache import table_versions, versions_statement, format_versions, make_etag
+from compression import compression
+from database import engine_options
+from ratelimit import limiter
+from models import User, Favorite_People, Favorite_Planet, People, Planets
+from utils import (APIException, ListQuery, get_page_args, serialize_row, wants_stream, parse_ids, by_ids_statement,
+                   in_requested_order, STREAM_BATCH_SIZE, NDJSON_MIMETYPE)
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite", "mysql": "mysql+aiomysql"}
+ASGI_SYNC_WORKERS = int(os.getenv("ASGI_SYNC_WORKERS", 10))
+
+flask_app = create_app()
+
+
+def async_url(url):
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+def create_engine():
+    url = os.getenv("ASYNC_DATABASE_URL") or async_url(flask_app.config["SQLALCHEMY_DATABASE_URI"])
+    options = engine_options(url)
+    # the async engine brings its own asyncio-aware queue pool
+    options.pop("poolclass", None)
+    return create_async_engine(url, **options)
+
+
+class Request:
+
+    def __init__(self, scope):
+        self.path = scope["path"]
+        self.query_string = scope["query_string"].decode("latin-1")
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        self.remote_addr = scope["client"][0] if scope.get("client") else None
+
+    @property
+    def full_path(self):
+        # same string as werkzeug's request.full_path, which the ETags are computed from
+        return f"{self.path}?{self.query_string}"
+
+    @property
+    def streamed(self):
+        return wants_stream(self.args, parse_accept_header(self.headers.get("accept"), MIMEAccept))
+
+    @property
+    def accept_encodings(self):
+        return parse_accept_header(self.headers.get("accept-encoding"), Accept)
+
+
+class Stream:
+    """Returned by a view to send its statement's rows as NDJSON."""
+
+    def __init__(self, statement):
+        self.statement = statement.execution_options(yield_per=STREAM_BATCH_SIZE)
+
+
+def listing(model, key):
+    async def view(request, session):
+        if "ids" in request.args:
+            ids = parse_ids(request.args["ids"])
+            found = {row.id: row._asdict() for row in await session.execute(by_ids_statement(model, ids))}
+            rows, missing = in_requested_order(found, ids)
+            return {key: rows, "missing": missing}, 200
+        query = ListQuery.from_request(model, request.args)
+        if request.streamed:
+            return Stream(query.keyset(request.args.get("after")))
+        limit, after = get_page_args(request.args)
+        rows = (await session.execute(query.page_statement(limit, after))).all()
+        rows, next_cursor = query.split_page(rows, limit)
+        return {key: [serialize_row(row) for row in rows], "next": next_cursor}, 200
+    return view
+
+def single(model, key, missing):
+    async def view(request, session, id):
+        row = await session.get(model, int(id))
+        if row is None:
+            return {"error": missing}, 404
+        return {key: row.serialize()}, 200
+    return view
+
+async def user_favorites(request, session, user_id):
+    user = (await session.execute(select(User).options(
+        selectinload(User.favorite_people.and_(Favorite_People.deleted_at.is_(None)))
+        .joinedload(Favorite_People.favorite_people),
+        selectinload(User.favorite_planet.and_(Favorite_Planet.deleted_at.is_(None)))
+        .joinedload(Favorite_Planet.favorite_planet)
+    ).filter_by(id=int(user_id)))).scalar_one_or_none()
+    if user is None:
+        return {"error": "User not found!"}, 404
+    return {"user_id": user.id, "favorites": user.serialize_favorites()}, 200
+
+
+# (path, view, Flask endpoint it stands in for, versions the ETag is computed from), mirroring the
+# @limiter.cost and @conditional decorators in app.py
+ROUTES = (
+    (re.compile(r"/users"), listing(User, "users"), "api.get_all_users", table_versions(User)),
+    (re.compile(r"/people"), listing(People, "people"), "api.get_all_people", table_versions(People)),
+    (re.compile(r"/planets"), listing(Planets, "planets"), "api.get_all_planets", table_versions(Planets)),
+    (re.compile(r"/people/(\d+)"), single(People, "person", "Person not found!"), "api.get_single_person",
+     table_versions(People)),
+    (re.compile(r"/planets/(\d+)"), single(Planets, "planet", "Planet not found!"), "api.get_single_planet",
+     table_versions(Planets)),
+    (re.compile(r"/users/(\d+)/favorites"), user_favorites, "api.get_single_user_favorites", user_favorites_versions),
+)
+
+
+def encode_headers(headers):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+
+
+class AsyncApp:
+
+    def __init__(self, wsgi_app, engine):
+        self.wsgi_app = wsgi_app
+        self.fallback = WSGIMiddleware(wsgi_app, workers=ASGI_SYNC_WORKERS)
+        self.engine = engine
+        self.session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            path = scope["path"].rstrip("/") or "/"
+            for pattern, view, endpoint, versions in ROUTES:
+                match = pattern.fullmatch(path)
+                if match:
+                    return await self.admit(scope, send, view, endpoint, versions, match.groups())
+        return await self.fallback(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def json_response(self, body, status):
+        response = self.wsgi_app.json.response(body)
+        response.status_code = status
+        return response
+
+    async def admit(self, scope, send, view, endpoint, versions, args):
+        request = Request(scope)
+        client = limiter.client_key(request.headers.get("x-api-key"), request.remote_addr,
+                                    request.headers.get("x-forwarded-for"))
+        cost = limiter.cost_of(self.wsgi_app.view_functions[endpoint], request.args, request.streamed)
+        # a shared bucket store is a network round trip, keep it off the event loop
+        if limiter.backend.local:
+            rejected = limiter.admit(client, cost)
+        else:
+            rejected = await asyncio.to_thread(limiter.admit, client, cost)
+        if rejected is not None:
+            body, status, retry_after = rejected
+            response = self.json_response(body, status)
+            response.headers["Retry-After"] = str(retry_after)
+            return await self.send_response(send, request, response)
+        try:
+            return await self.handle(request, send, view, versions, args)
+        finally:
+            limiter.release()
+
+    async def handle(self, request, send, view, versions, args):
+        etag = None
+        async with self.session() as session:
+            try:
+                row = (await session.execute(versions_statement(versions(*args)))).one()
+                etag = make_etag(format_versions(row), request.full_path, request.streamed)
+                if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+                    response = Response(status=304)
+                else:
+                    result = await view(request, session, *args)
+                    if isinstance(result, Stream):
+                        return await self.stream(send, request, session, result.statement, etag)
+                    response = self.json_response(*result)
+            except APIException as error:
+                response = self.json_response(error.to_dict(), error.status_code)
+            except PoolTimeoutError:
+                response = self.json_response({"error": "Database busy, try again later"}, 503)
+                response.headers["Retry-After"] = "1"
+        await self.send_response(send, request, response, etag)
+
+    def prepare(self, request, response, etag):
+        if etag is not None and response.status_code in (200, 304):
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = self.wsgi_app.config["CACHE_CONTROL_DEFAULT"]
+        origin = request.headers.get("origin")
+        if origin:
+            # what flask_cors sends for CORS(app)
+            response.headers["Access-Control-Allow-Origin"] = origin
+            response.vary.add("Origin")
+
+    async def send_response(self, send, request, response, etag=None):
+        self.prepare(request, response, etag)
+        compression.apply(response, request.accept_encodings)
+        body = response.get_data()
+        response.headers["Content-Length"] = str(len(body))
+        await send({"type": "http.response.start", "status": response.status_code,
+                    "headers": encode_headers(response.headers)})
+        await send({"type": "http.response.body", "body": body})
+
+    async def stream(self, send, request, session, statement, etag):
+        result = await session.stream(statement)
+        response = Response(mimetype=NDJSON_MIMETYPE)
+        self.prepare(request, response, etag)
+        compressor = compression.start_stream(response, request.accept_encodings)
+        await send({"type": "http.response.start", "status": 200, "headers": encode_headers(response.headers)})
+        dumps = self.wsgi_app.json.dumps
+        # one chunk per STREAM_BATCH_SIZE rows fetched
+        async for rows in result.partitions():
+            body = "".join(dumps(serialize_row(row)) + "\n" for row in rows).encode()
+            if compressor is not None:
+                body = compressor.chunk(body)
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+        await send({"type": "http.response.body", "body": compressor.end() if compressor is not None else b""})
+
+
+application = AsyncApp(flask_app, create_engine())
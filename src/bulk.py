@@ -0,0 +1,167 @@
+"""
+Batch inserts for the /bulk endpoints.
+
+Items are validated in one pass, each field against its column's type so one bad
+item is reported on its own instead of failing its whole batch, uniqueness and foreign keys are checked with a
+single IN query per batch and each batch is written as one executemany INSERT
+in its own transaction. Every input item gets an entry in the result report.
+"""
+import os
+from flask import request, json
+from sqlalchemy import insert, tuple_, BigInteger, Integer, String
+from database import insert_or_revive
+from popularity import recount
+from models import db, User, Favorite_People, Favorite_Planet, People, Planets
+from utils import APIException, NDJSON_MIMETYPE
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 1000))
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", 100000))
+
+
+def read_items():
+    # JSON array body, or one JSON object per line with Content-Type: application/x-ndjson
+    if request.mimetype == NDJSON_MIMETYPE:
+        items = []
+        for number, line in enumerate(request.stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise APIException(f"Invalid JSON on line {number}", status_code=400)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            raise APIException("Expected a JSON array of objects", status_code=400)
+    if len(items) > MAX_BULK_ITEMS:
+        raise APIException(f"At most {MAX_BULK_ITEMS} items per request", status_code=413)
+    return items
+
+def batches(items, size=None):
+    size = size or BULK_BATCH_SIZE
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+def existing(column, values):
+    if not values:
+        return set()
+    return {value for (value,) in db.session.query(column).filter(column.in_(set(values)))}
+
+def is_integer(value, bits=32):
+    # bool is an int to Python but not to the database
+    return (isinstance(value, int) and not isinstance(value, bool)
+            and -2 ** (bits - 1) <= value < 2 ** (bits - 1))
+
+def invalid_field(model, item, fields):
+    """Why the first field the column can't store is invalid, None if they all fit."""
+    for field in fields:
+        value, column_type = item[field], getattr(model, field).type
+        if isinstance(column_type, String):
+            if not isinstance(value, str) or (column_type.length and len(value) > column_type.length):
+                return f"{field} must be a string of at most {column_type.length} characters"
+        elif isinstance(column_type, Integer):
+            if not is_integer(value, 64 if isinstance(column_type, BigInteger) else 32):
+                return f"{field} must be an integer"
+    return None
+
+def error(index, message):
+    return {"index": index, "status": "error", "error": message}
+
+def insert_batch(model, rows, results, statement=None, before_commit=None):
+    if not rows:
+        return
+    try:
+        db.session.execute(insert(model) if statement is None else statement, [row for _, row in rows])
+        if before_commit is not None:
+            before_commit()
+        db.session.commit()
+        for index, _ in rows:
+            results[index] = {"index": index, "status": "created"}
+    except Exception as exc:
+        db.session.rollback()
+        for index, _ in rows:
+            results[index] = error(index, f"{exc}")
+
+def create_catalog(model, items, fields, batch_size=None):
+    """Bulk insert People or Planets; every field is required and names must be unique."""
+    results = [None] * len(items)
+    seen = set()
+    for start, batch in batches(items, batch_size):
+        candidates = []
+        for index, item in enumerate(batch, start=start):
+            if not isinstance(item, dict) or any(item.get(field) is None for field in fields):
+                results[index] = error(index, "Missing values")
+                continue
+            invalid = invalid_field(model, item, fields)
+            if invalid is not None:
+                results[index] = error(index, invalid)
+            elif item["name"] in seen:
+                results[index] = error(index, f"{item['name']} is repeated in the request")
+            else:
+                seen.add(item["name"])
+                candidates.append((index, {field: item[field] for field in fields}))
+
+        taken = existing(model.name, [row["name"] for _, row in candidates])
+        rows = []
+        for index, row in candidates:
+            if row["name"] in taken:
+                results[index] = error(index, f"{row['name']} already exists!")
+            else:
+                rows.append((index, row))
+        insert_batch(model, rows, results)
+    return results
+
+def create_favorites(items, batch_size=None):
+    """Bulk insert favorites, each item is {user_id, people_id} or {user_id, planet_id}."""
+    results = [None] * len(items)
+    kinds = (
+        ("people_id", Favorite_People, People),
+        ("planet_id", Favorite_Planet, Planets),
+    )
+    for start, batch in batches(items, batch_size):
+        valid = []
+        for index, item in enumerate(batch, start=start):
+            if not isinstance(item, dict) or item.get("user_id") is None:
+                results[index] = error(index, "Missing values!")
+            elif (item.get("people_id") is None) == (item.get("planet_id") is None):
+                results[index] = error(index, "Expected exactly one of people_id or planet_id")
+            elif not all(is_integer(item[key]) for key in ("user_id", "people_id", "planet_id")
+                         if item.get(key) is not None):
+                results[index] = error(index, "user_id, people_id and planet_id must be integers")
+            else:
+                valid.append((index, item))
+
+        users = existing(User.id, [item["user_id"] for _, item in valid])
+        for key, favorite_model, target_model in kinds:
+            candidates = [(index, item) for index, item in valid if item.get(key) is not None]
+            targets = existing(target_model.id, [item[key] for _, item in candidates])
+            pairs = {(item["user_id"], item[key]) for _, item in candidates}
+            already = set()
+            if pairs:
+                columns = tuple_(favorite_model.user_id, getattr(favorite_model, key))
+                already = {tuple(row) for row in db.session.query(favorite_model.user_id, getattr(favorite_model, key))
+                           .filter(columns.in_(pairs), favorite_model.deleted_at.is_(None))}
+            rows = []
+            for index, item in candidates:
+                pair = (item["user_id"], item[key])
+                if item["user_id"] not in users:
+                    results[index] = error(index, "User not found!")
+                elif item[key] not in targets:
+                    results[index] = error(index, f"{target_model.__name__} not found!")
+                elif pair in already:
+                    results[index] = error(index, "Already a favorite")
+                else:
+                    already.add(pair)
+                    rows.append((index, {"user_id": pair[0], key: pair[1]}))
+            # a pair written by a concurrent request since the check above is skipped rather than failing the batch
+            # counts are recomputed rather than incremented since skipped conflicts aren't reported per row
+            touched = {row[key] for _, row in rows}
+            insert_batch(favorite_model, rows, results,
+                         insert_or_revive(db.engine.dialect.name, favorite_model, "user_id", key),
+                         before_commit=lambda: recount(target_model, touched))
+    return results
+
+def report(results):
+    failed = sum(1 for result in results if result["status"] != "created")
+    body = {"created": len(results) - failed, "failed": failed, "results": results}
+    return body, 201 if failed == 0 else 207
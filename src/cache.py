@@ -0,0 +1,337 @@
+"""
+Read-through response cache for the catalog endpoints (people, planets).
+
+Entries are keyed by resource + path + query string and grouped into namespaces:
+"<resource>:list" for collection pages and "<resource>:<id>" for single items.
+Each namespace carries a generation counter that is part of the key, so
+invalidating a namespace is a single counter bump on any backend.
+
+`conditional` adds ETag / If-None-Match handling, from the row versions the
+view reads (see latest_version). It goes inside `cached`, which keeps each
+page's ETag with it, so a cache hit is answered, 304 included, without a query.
+`cache.idempotent` replays the stored response of a write retried with the
+same Idempotency-Key header. Keys are scoped by caller: the client the rate
+limiter sees (API key or address) and the user_id the write is for, so two
+clients that pick the same key never get each other's responses. A retry
+from another address runs again instead of being replayed.
+"""
+import os
+import json
+import time
+import threading
+import hashlib
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, Response, current_app, jsonify
+from sqlalchemy import func, select
+from models import db, ChangeCounter, counter_value, row_version_horizon
+from ratelimit import limiter
+from utils import wants_stream, by_ids_statement
+
+
+class LRUCache:
+    """In-process backend: bounded by max_entries, entries expire after ttl seconds."""
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # generation counters live outside the LRU so eviction can never reset them
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set_many(self, mapping, ttl=None):
+        for key, value in mapping.items():
+            self.set(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """Shared backend for multiple workers. Any client with the redis-py get/set/delete/incr API works."""
+
+    def __init__(self, client, ttl=60, prefix="swapi:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl if ttl is None else ttl)
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        return [None if raw is None else json.loads(raw) for raw in self.client.mget([self.prefix + key for key in keys])]
+
+    def set_many(self, mapping, ttl=None):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(self.prefix + key, json.dumps(value), ex=self.ttl if ttl is None else ttl)
+        pipeline.execute()
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def counter(self, key):
+        raw = self.client.get(self.prefix + key)
+        return int(raw or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+
+class ResponseCache:
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.replays = None
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("CACHE_ENABLED", os.getenv("CACHE_ENABLED", "1") == "1")
+        app.config.setdefault("CACHE_URL", os.getenv("CACHE_URL"))
+        app.config.setdefault("CACHE_TTL", int(os.getenv("CACHE_TTL", 60)))
+        app.config.setdefault("CACHE_MAX_ENTRIES", int(os.getenv("CACHE_MAX_ENTRIES", 1024)))
+        app.config.setdefault("CACHE_CONTROL_DEFAULT", os.getenv("CACHE_CONTROL_DEFAULT", "no-cache"))
+        app.config.setdefault("IDEMPOTENCY_TTL", int(os.getenv("IDEMPOTENCY_TTL", 86400)))
+        app.config.setdefault("IDEMPOTENCY_MAX_KEYS", int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10000)))
+        self.enabled = app.config["CACHE_ENABLED"]
+        if self.backend is None:
+            if app.config["CACHE_URL"]:
+                self.backend = RedisCache.from_url(app.config["CACHE_URL"], ttl=app.config["CACHE_TTL"])
+            else:
+                self.backend = LRUCache(app.config["CACHE_MAX_ENTRIES"], app.config["CACHE_TTL"])
+        # replays are kept apart so cached pages can never evict them, and even with CACHE_ENABLED off
+        if self.replays is None:
+            if app.config["CACHE_URL"]:
+                self.replays = RedisCache.from_url(app.config["CACHE_URL"], ttl=app.config["IDEMPOTENCY_TTL"],
+                                                   prefix="swapi:idem:")
+            else:
+                self.replays = LRUCache(app.config["IDEMPOTENCY_MAX_KEYS"], app.config["IDEMPOTENCY_TTL"])
+        app.extensions["response_cache"] = self
+
+    @staticmethod
+    def namespace(resource, id=None):
+        return f"{resource}:list" if id is None else f"{resource}:{id}"
+
+    def key(self, resource, id=None):
+        namespace = self.namespace(resource, id)
+        generation = self.backend.counter("gen:" + namespace)
+        args = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+        return f"{namespace}:{generation}:{request.path}?{args}"
+
+    def invalidate(self, resource, id=None):
+        # A created/updated/deleted row always changes the collection pages, and its own item entry if given
+        self.backend.incr("gen:" + self.namespace(resource))
+        if id is not None:
+            self.backend.incr("gen:" + self.namespace(resource, id))
+
+    def _count(self, hit, count=1):
+        with self._lock:
+            if hit:
+                self.hits += count
+            else:
+                self.misses += count
+
+    def rows(self, resource, model, ids):
+        """
+        Serialized rows by id: cached ones in one backend round trip, the rest in one IN query.
+        Row entries share the collection's generation, so any write to the resource drops them.
+        """
+        found = {}
+        if self.enabled:
+            generation = self.backend.counter("gen:" + self.namespace(resource))
+            keys = {id: f"{resource}:row:{generation}:{id}" for id in ids}
+            for id, value in zip(ids, self.backend.get_many([keys[id] for id in ids])):
+                if value is not None:
+                    found[id] = value
+            self._count(True, len(found))
+        missing = [id for id in ids if id not in found]
+        if missing:
+            loaded = {row.id: row._asdict() for row in db.session.execute(by_ids_statement(model, missing))}
+            found.update(loaded)
+            if self.enabled:
+                self._count(False, len(missing))
+                if loaded:
+                    self.backend.set_many({keys[id]: value for id, value in loaded.items()})
+        return found
+
+    def cached(self, resource):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or wants_stream():
+                    return view(*args, **kwargs)
+                key = self.key(resource, kwargs.get("id"))
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self._count(True)
+                    # the ETag and Cache-Control @conditional gave the page, so a hit can revalidate on its own
+                    body, mimetype, *validators = entry
+                    etag, cache_control = validators or (None, None)
+                    if etag is None:
+                        return Response(body, status=200, mimetype=mimetype)
+                    if not_modified(etag):
+                        return tag(Response(status=304), etag, cache_control)
+                    return tag(Response(body, status=200, mimetype=mimetype), etag, cache_control)
+                self._count(False)
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    etag, _ = response.get_etag()
+                    self.backend.set(key, [response.get_data(as_text=True), response.mimetype, etag,
+                                           response.headers.get("Cache-Control")])
+                return response
+            return wrapper
+        return decorator
+
+    def idempotent(self, view):
+        """A retry carrying the same Idempotency-Key gets the first response back instead of running again."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get("Idempotency-Key")
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > 255:
+                return jsonify({"error": "Idempotency-Key is longer than 255 characters"}), 400
+            body = request.get_json(silent=True)
+            user_id = kwargs.get("user_id", body.get("user_id") if isinstance(body, dict) else None)
+            replay_key = f"{limiter.request_client()}:{user_id}:{request.method}:{request.path}:{key}"
+            fingerprint = hashlib.sha1(request.get_data()).hexdigest()
+            entry = self.replays.get(replay_key)
+            if entry is not None:
+                stored_fingerprint, body, status, mimetype = entry
+                if stored_fingerprint != fingerprint:
+                    return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+                response = Response(body, status=status, mimetype=mimetype)
+                response.headers["Idempotent-Replayed"] = "true"
+                return response
+            response = make_response(view(*args, **kwargs))
+            # server errors are worth retrying for real
+            if response.status_code < 500:
+                self.replays.set(replay_key, [fingerprint, response.get_data(as_text=True), response.status_code,
+                                              response.mimetype])
+            return response
+        return wrapper
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+def latest_version(model, *criteria):
+    """max(row_version) of the rows matching criteria, read off the end of an index."""
+    return select(func.max(model.row_version)).where(*criteria).scalar_subquery()
+
+def table_versions(*models):
+    """The versions source of a view that reads whole tables: the latest version of each."""
+    def versions(*args, **kwargs):
+        return [latest_version(model) for model in models]
+    return versions
+
+def versions_statement(latest):
+    # one round trip for the whole ETag; deleted_version moves when a row is deleted outright (the admin)
+    return select(*latest, counter_value(ChangeCounter.deleted_version), row_version_horizon())
+
+def format_versions(row):
+    *latest, deleted, horizon = row
+    parts = []
+    for version in latest:
+        if horizon is not None and version is not None and horizon <= version:
+            # Postgres: a transaction still running below this version can commit rows without
+            # moving it, the horizon moves when that transaction ends (see models.next_row_version)
+            parts.append(f"{version}<{horizon}")
+        else:
+            parts.append(str(version))
+    parts.append(f"deleted:{deleted}")
+    return parts
+
+def make_etag(versions, full_path, streamed):
+    return hashlib.sha1(f"{'|'.join(versions)}|{full_path}|{streamed}".encode()).hexdigest()
+
+def not_modified(etag):
+    # weak comparison: a compressed response goes out with the weak form of the tag (see compression.py)
+    return request.if_none_match.contains_weak(etag)
+
+def tag(response, etag, cache_control=None):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control or current_app.config["CACHE_CONTROL_DEFAULT"]
+    return response
+
+def conditional(*models, versions=None, cache_control=None):
+    """Strong ETag from the row versions the view reads; answers If-None-Match with a bare 304.
+
+    versions(*args, **kwargs) gets the view's arguments and returns the latest_version() subqueries to
+    read, by default those of the whole tables in models. Put @cache.cached outside: a cached page
+    carries its ETag, so a hit needs no query at all.
+    """
+    versions = versions or table_versions(*models)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            row = db.session.execute(versions_statement(versions(*args, **kwargs))).one()
+            etag = make_etag(format_versions(row), request.full_path, wants_stream())
+            if not_modified(etag):
+                return tag(Response(status=304), etag, cache_control)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            return tag(response, etag, cache_control)
+        return wrapper
+    return decorator
+
+
+cache = ResponseCache()
@@ -0,0 +1,129 @@
+"""
+Change feed for GET /changes, so clients can fetch what changed since their last sync instead of whole tables.
+
+People, planets and both favorites tables carry row_version and updated_at
+(models.Versioned), stamped by the INSERT or UPDATE itself (models.next_row_version).
+On Postgres the version is the writing transaction's id, so transactions
+don't wait on each other for it but can commit out of order; the feed only
+returns versions below the oldest transaction still running
+(models.row_version_horizon). SQLite, and the counter row other databases use,
+hand out versions in commit order already. Either way, once a client has read
+version v, nothing at or below v can still show up.
+
+    GET /changes?since=<token>&limit=
+
+returns the rows changed after the token, in version order, and the token to
+send next time. Each table is read with a range scan of its (row_version, id)
+index starting at the token, so a poll costs as much as the changes it returns.
+since=0, or no since, starts from the beginning.
+
+Removed favorites stay in their table as tombstones (deleted_at set) and come
+back with "deleted": true.
+
+    $ flask changes purge --days 30
+
+deletes tombstones older than that. A token from before the purge is answered
+410, and the client starts again from since=0.
+"""
+from datetime import timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, update, delete, func, tuple_
+from models import (db, ChangeCounter, People, Planets, Favorite_People, Favorite_Planet, counter_value,
+                    row_version_horizon)
+from utils import APIException
+
+# resource name, model, columns sent as data; a resource's position is part of the token
+FEEDS = (
+    ("people", People, People.public_fields),
+    ("planets", Planets, Planets.public_fields),
+    ("favorite_people", Favorite_People, ("id", "user_id", "people_id")),
+    ("favorite_planets", Favorite_Planet, ("id", "user_id", "planet_id")),
+)
+
+
+def parse_token(since):
+    """(version, feed position, id) of the last change the client has; a bare version means all of it."""
+    try:
+        parts = [int(part) for part in (since or "0").split(",")]
+    except ValueError:
+        raise APIException("Invalid since token", status_code=400)
+    if len(parts) == 1:
+        return parts[0], len(FEEDS), 0
+    if len(parts) != 3:
+        raise APIException("Invalid since token", status_code=400)
+    return tuple(parts)
+
+def after(model, position, token):
+    # rows sort by (row_version, feed position, id) across the feeds
+    version, token_position, id = token
+    if position < token_position:
+        return model.row_version > version
+    if position > token_position:
+        return model.row_version >= version
+    return tuple_(model.row_version, model.id) > (version, id)
+
+def feed_statement(model, fields, position, token, limit, horizon=None):
+    columns = [model.row_version, model.updated_at] + [getattr(model, name) for name in fields]
+    if hasattr(model, "deleted_at"):
+        columns.append(model.deleted_at)
+    statement = select(*columns).where(after(model, position, token))
+    if horizon is not None:
+        statement = statement.where(model.row_version < horizon)
+    return statement.order_by(model.row_version, model.id).limit(limit + 1)
+
+def serialize_change(resource, fields, row):
+    return {
+        "resource": resource,
+        "id": row.id,
+        "version": row.row_version,
+        "updated_at": row.updated_at.isoformat(),
+        "deleted": getattr(row, "deleted_at", None) is not None,
+        "data": {name: getattr(row, name) for name in fields},
+    }
+
+def feed(since, limit):
+    token = parse_token(since)
+    purged, horizon = db.session.execute(select(counter_value(ChangeCounter.purged_version),
+                                                row_version_horizon())).one()
+    purged = purged or 0
+    if token[0] > 0 and token[:2] < (purged, len(FEEDS)):
+        raise APIException("since is older than the kept history, start again from since=0", status_code=410)
+    found = []
+    for position, (resource, model, fields) in enumerate(FEEDS):
+        # limit + 1 per feed is enough to fill the page and know whether there is more
+        for row in db.session.execute(feed_statement(model, fields, position, token, limit, horizon)):
+            found.append(((row.row_version, position, row.id), resource, fields, row))
+    found.sort(key=lambda entry: entry[0])
+    page = found[:limit]
+    return {
+        "changes": [serialize_change(resource, fields, row) for _, resource, fields, row in page],
+        "next": ",".join(str(part) for part in page[-1][0]) if page else (since or "0"),
+        "more": len(found) > limit,
+    }
+
+
+cli = AppGroup("changes", help="Change feed behind GET /changes")
+
+
+@cli.command("purge")
+@click.option("--days", default=30, show_default=True, help="Keep tombstones removed in the last DAYS days.")
+def purge_command(days):
+    """Delete old favorite tombstones; clients holding an older token must sync again from since=0."""
+    # the database's own clock, the one deleted_at was written with
+    cutoff = db.session.execute(select(func.now())).scalar() - timedelta(days=days)
+    tombstoned = [model for _, model, _ in FEEDS if hasattr(model, "deleted_at")]
+    versions = [db.session.execute(select(func.max(model.row_version)).where(model.deleted_at < cutoff)).scalar()
+                for model in tombstoned]
+    horizon = max((version for version in versions if version is not None), default=None)
+    if horizon is None:
+        click.echo("no tombstones to purge")
+        return
+    removed = 0
+    for model in tombstoned:
+        removed += db.session.execute(delete(model).where(model.deleted_at.isnot(None),
+                                                          model.row_version <= horizon)).rowcount
+    db.session.execute(update(ChangeCounter).where(ChangeCounter.id == 1, ChangeCounter.purged_version < horizon)
+                       .values(purged_version=horizon))
+    db.session.commit()
+    click.echo(f"{removed} tombstones purged, tokens before version {horizon} now get 410")
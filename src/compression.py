@@ -0,0 +1,179 @@
+"""
+gzip / brotli response compression, negotiated from Accept-Encoding.
+
+JSON, NDJSON, HTML and text responses of at least COMPRESS_MIN_SIZE bytes are
+compressed with whichever of br and gzip the client ranks higher (br on a tie,
+when the brotli package is installed). Streamed responses (?stream=1) are
+compressed chunk by chunk, each chunk flushed so rows still reach the client as
+they are read.
+
+A response with an ETag always has the same body for that ETag, so its
+compressed body is kept per worker (COMPRESS_CACHE_MAX_ENTRIES) and reused on
+the next hit instead of compressing the same page again. Compressed responses
+carry the weak form of the ETag, since their bytes differ from the identity
+body; If-None-Match is compared weakly (see cache.conditional), so a client
+revalidating either form still gets 304.
+"""
+import os
+import zlib
+import threading
+from flask import request
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/html", "text/plain", "text/csv")
+# entries are keyed by ETag and never go stale, the TTL only bounds how long an unused one holds memory
+BODY_TTL = 3600
+
+
+def encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+def negotiate(accept_encodings):
+    """The encoding to answer with for a parsed Accept-Encoding header, None for identity."""
+    return accept_encodings.best_match(encodings())
+
+
+class Compressor:
+    """One compressed stream: chunk() returns bytes that can be sent right away, end() the trailer."""
+
+    def __init__(self, encoding, gzip_level=6, brotli_quality=5):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31: deflate with the gzip header and trailer
+            self._gzip = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._gzip.compress(data) + self._gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def end(self):
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._gzip.flush()
+
+def compress_stream(chunks, compressor):
+    try:
+        for chunk in chunks:
+            data = compressor.chunk(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.end()
+    finally:
+        # the wrapped generator holds the streaming session, see utils.ListQuery.stream
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+class Compression:
+
+    def __init__(self):
+        self.enabled = True
+        self.min_size = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 5
+        self.bodies = None
+        self.compressed = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_ENABLED", os.getenv("COMPRESS_ENABLED", "1") == "1")
+        app.config.setdefault("COMPRESS_MIN_SIZE", int(os.getenv("COMPRESS_MIN_SIZE", self.min_size)))
+        app.config.setdefault("COMPRESS_GZIP_LEVEL", int(os.getenv("COMPRESS_GZIP_LEVEL", self.gzip_level)))
+        app.config.setdefault("COMPRESS_BROTLI_QUALITY", int(os.getenv("COMPRESS_BROTLI_QUALITY", self.brotli_quality)))
+        app.config.setdefault("COMPRESS_CACHE_MAX_ENTRIES", int(os.getenv("COMPRESS_CACHE_MAX_ENTRIES", 256)))
+        self.enabled = app.config["COMPRESS_ENABLED"]
+        self.min_size = app.config["COMPRESS_MIN_SIZE"]
+        self.gzip_level = app.config["COMPRESS_GZIP_LEVEL"]
+        self.brotli_quality = app.config["COMPRESS_BROTLI_QUALITY"]
+        self.bodies = LRUCache(app.config["COMPRESS_CACHE_MAX_ENTRIES"], BODY_TTL)
+        app.after_request(self._after_request)
+        app.extensions["compression"] = self
+
+    def compressor(self, encoding):
+        return Compressor(encoding, self.gzip_level, self.brotli_quality)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def compressible(self, response):
+        return (self.enabled and 200 <= response.status_code < 300 and response.status_code not in (204, 206)
+                and response.mimetype in COMPRESSIBLE_MIMETYPES
+                and "Content-Encoding" not in response.headers
+                and not response.direct_passthrough
+                and not response.cache_control.no_transform)
+
+    def start_stream(self, response, accept_encodings):
+        """Sets the headers of a compressed stream and returns its Compressor, or None to send it as is."""
+        if not self.compressible(response):
+            return None
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(accept_encodings)
+        if encoding is None:
+            return None
+        self.mark(response, encoding)
+        response.headers.pop("Content-Length", None)
+        self._count("compressed")
+        return self.compressor(encoding)
+
+    def mark(self, response, encoding):
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+    def encode_body(self, body, encoding, etag):
+        key = f"{etag}:{encoding}" if etag else None
+        if key is not None:
+            cached = self.bodies.get(key)
+            if cached is not None:
+                self._count("reused")
+                return cached
+        compressor = self.compressor(encoding)
+        compressed = compressor.chunk(body) + compressor.end()
+        self._count("compressed")
+        if key is not None:
+            self.bodies.set(key, compressed)
+        return compressed
+
+    def apply(self, response, accept_encodings):
+        if response.is_streamed:
+            compressor = self.start_stream(response, accept_encodings)
+            if compressor is not None:
+                response.response = compress_stream(response.response, compressor)
+            return response
+        if not self.compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(accept_encodings)
+        body = response.get_data()
+        if encoding is None or len(body) < self.min_size:
+            return response
+        etag, weak = response.get_etag()
+        response.set_data(self.encode_body(body, encoding, None if weak else etag))
+        self.mark(response, encoding)
+        return response
+
+    def _after_request(self, response):
+        return self.apply(response, request.accept_encodings)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "encodings": list(encodings()),
+            "compressed": self.compressed,
+            "reused": self.reused,
+            "cached_bodies": len(self.bodies) if self.bodies is not None else 0,
+        }
+
+
+compression = Compression()
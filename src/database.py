@@ -0,0 +1,249 @@
+"""
+Engine configuration for the SQLAlchemy connection pool and read replicas.
+
+Pool sizing comes from the environment so each deployment can fit
+(workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)) under the server's max_connections.
+
+DATABASE_REPLICA_URLS is a comma separated list of read replicas, registered as
+the binds replica_0, replica_1, ... Views decorated with @read_only send their
+SELECTs to one of them, round-robin, and fall back to the primary when the
+replica can't be reached. Two SQLite files work as primary and replica locally:
+
+    DATABASE_URL=sqlite:////tmp/primary.db DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db
+
+insert_or_revive builds the dialect's single-statement "insert unless it already exists",
+inserted() and revive() read its outcome.
+"""
+import os
+import time
+import threading
+from functools import wraps
+from itertools import cycle
+from flask import g, has_app_context, current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, insert, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def reset(self):
+        self.__init__()
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.incr("timeouts")
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - started)
+
+
+def uses_queue_pool(url):
+    # in-memory SQLite is bound to a single connection and can't take pool sizing options
+    return not (url.startswith("sqlite") and (":memory:" in url or url.rstrip("/") == "sqlite:"))
+
+def engine_options(url):
+    options = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    }
+    if uses_queue_pool(url):
+        options.update({
+            "poolclass": InstrumentedQueuePool,
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+            "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        })
+    return options
+
+def instrument_engine(engine):
+    event.listen(engine, "connect", lambda *args: pool_stats.incr("connects"))
+    event.listen(engine, "checkout", lambda *args: pool_stats.incr("checkouts"))
+    event.listen(engine, "invalidate", lambda *args: pool_stats.incr("invalidations"))
+
+def dispose_after_fork(engines):
+    """
+    Connections opened in the parent (gunicorn --preload, migrations on boot)
+    must not be shared with the forked workers, each child starts with an empty pool.
+    """
+    def reset_pools():
+        for engine in engines:
+            engine.dispose(close=False)
+        pool_stats.reset()
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=reset_pools)
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "timeout": pool.timeout(),
+        })
+    status.update({
+        "checkouts": pool_stats.checkouts,
+        "connects": pool_stats.connects,
+        "invalidations": pool_stats.invalidations,
+        "timeouts": pool_stats.timeouts,
+        "wait_count": pool_stats.wait_count,
+        "wait_avg_ms": round(1000 * pool_stats.wait_total / pool_stats.wait_count, 3) if pool_stats.wait_count else 0.0,
+        "wait_max_ms": round(1000 * pool_stats.wait_max, 3),
+    })
+    return status
+
+
+def insert_or_revive(dialect, model, *conflict_columns):
+    """
+    INSERT that skips rows colliding with a live row on the unique key conflict_columns instead of raising,
+    in a single statement; inserted() tells whether it wrote the row. A soft-deleted row (deleted_at set)
+    in the way is brought back instead, with the row_version and updated_at the INSERT would have written.
+    Other dialects get a plain INSERT, which raises IntegrityError on any conflict (see revive).
+    """
+    stamped = ("row_version", "updated_at")
+    if dialect in ("postgresql", "sqlite"):
+        statement = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(model)
+        return statement.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={"deleted_at": None, **{name: statement.excluded[name] for name in stamped}},
+            where=model.deleted_at.isnot(None),
+        )
+    if dialect in ("mysql", "mariadb"):
+        # assignments run left to right, deleted_at is cleared after the others have read it.
+        # ON DUPLICATE KEY UPDATE can't skip the live row, and with CLIENT_FOUND_ROWS leaving it as it is
+        # still counts 1 like an insert, so LAST_INSERT_ID(expr) marks it instead: the statement's insert
+        # id is 0 for the live row, the revived row's id otherwise
+        statement = mysql.insert(model)
+        live = model.deleted_at.is_(None)
+        return statement.on_duplicate_key_update([
+            ("id", func.if_(live, model.id + func.last_insert_id(0), func.last_insert_id(model.id))),
+            *[(name, func.if_(live, getattr(model, name), statement.inserted[name])) for name in stamped],
+            ("deleted_at", None),
+        ])
+    return insert(model)
+
+
+def inserted(dialect, result):
+    """Whether a single-row insert_or_revive wrote its row, False when a live row was already there."""
+    if dialect in ("mysql", "mariadb"):
+        return bool(result.lastrowid)
+    return result.rowcount != 0
+
+
+def revive(model, **key):
+    """
+    For the plain INSERT of insert_or_revive, after it raised IntegrityError and the session was rolled back:
+    brings back the soft-deleted row with that unique key. True when it did, False when the row is live,
+    None when there is no such row, i.e. the violation was a foreign key.
+    """
+    row = model.query.filter_by(**key).with_entities(model.id).first()
+    if row is None:
+        return None
+    return bool(model.query.filter(model.id == row.id, model.deleted_at.isnot(None))
+                .update({"deleted_at": None}, synchronize_session=False))
+
+
+def replica_binds(urls):
+    urls = [url.strip().replace("postgres://", "postgresql://") for url in (urls or "").split(",") if url.strip()]
+    return {f"replica_{index}": url for index, url in enumerate(urls)}
+
+
+class ReplicaRouter:
+    """Round-robin over the replica bind keys, skipping replicas that failed in the last down_for seconds."""
+
+    def __init__(self, down_for=30):
+        self.keys = []
+        self.down_for = down_for
+        self._down_until = {}
+        self._cycle = cycle(())
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.keys = [key for key in app.config.get("SQLALCHEMY_BINDS", {}) if key.startswith("replica_")]
+        self.down_for = int(os.getenv("DATABASE_REPLICA_DOWN_FOR", self.down_for))
+        self._cycle = cycle(self.keys)
+        self._down_until = {}
+
+    def pick(self):
+        now = time.monotonic()
+        with self._lock:
+            for _ in self.keys:
+                key = next(self._cycle)
+                if self._down_until.get(key, 0) <= now:
+                    return key
+        return None
+
+    def mark_down(self, key):
+        with self._lock:
+            self._down_until[key] = time.monotonic() + self.down_for
+
+
+router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """
+    Sends reads to the replica chosen for the current request, anything else to the primary.
+    Once the session has written, the rest of the request stays on the primary so it reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get("db_replica") if has_app_context() else None
+        if replica is not None and bind is None:
+            if self._flushing or getattr(clause, "is_dml", False):
+                self.info["wrote"] = True
+            elif not self.info.get("wrote"):
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Route the view's queries to a replica; retry once on the primary if the replica is unreachable."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_replica = router.pick()
+        if g.db_replica is None:
+            return view(*args, **kwargs)
+        try:
+            return view(*args, **kwargs)
+        except OperationalError:
+            router.mark_down(g.db_replica)
+            g.db_replica = None
+            current_app.extensions["sqlalchemy"].session.rollback()
+            return view(*args, **kwargs)
+    return wrapper
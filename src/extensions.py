@@ -0,0 +1,75 @@
+"""
+The parts of the app a worker doesn't need to serve the API, imported the first time they are used.
+
+Flask-Admin (with its SQLAlchemy views) and Flask-Migrate (with Alembic) are each
+about half a second of imports, paid by every worker and every new instance
+before it can answer a request. Instead:
+
+- ADMIN_ENABLED=1 mounts a placeholder at /admin that builds the admin, a small
+  Flask app of its own set up by admin.setup_admin, on the first request to it.
+  ADMIN_ENABLED=0 leaves /admin out altogether.
+- `flask db ...` is a command group that imports Flask-Migrate only when one of
+  its commands runs, so `flask db upgrade` works exactly as before.
+- SWAGGER_ENABLED=1 adds GET /swagger.json, built by flask_swagger when requested.
+"""
+import threading
+import click
+from flask import Flask, jsonify, current_app
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from models import db
+
+ADMIN_PREFIX = "/admin"
+# what the admin app needs from the API's config, it only ever talks to the primary
+ADMIN_CONFIG = ("SQLALCHEMY_DATABASE_URI", "SQLALCHEMY_ENGINE_OPTIONS", "SQLALCHEMY_TRACK_MODIFICATIONS")
+
+
+def create_admin_app(config):
+    from admin import setup_admin
+    admin_app = Flask(__name__)
+    admin_app.config.update({key: config[key] for key in ADMIN_CONFIG if key in config})
+    db.init_app(admin_app)
+    # the dispatcher strips ADMIN_PREFIX, so inside this app the admin index is the root
+    setup_admin(admin_app, url="/")
+    return admin_app
+
+
+class LazyAdmin:
+    """WSGI app for everything under /admin, builds the real one on its first request."""
+
+    def __init__(self, config):
+        self.config = config
+        self.app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self.app is None:
+            with self._lock:
+                if self.app is None:
+                    self.app = create_admin_app(self.config)
+        return self.app(environ, start_response)
+
+
+def mount_admin(app):
+    app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {ADMIN_PREFIX: LazyAdmin(app.config)})
+
+
+class LazyMigrateGroup(click.Group):
+    """`flask db`, handing the command line to Flask-Migrate's own group once it is invoked."""
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as migrate_group
+        if "migrate" not in current_app.extensions:
+            Migrate(current_app, db)
+        # click runs whichever command the returned context belongs to
+        return migrate_group.make_context(info_name, args, parent=parent, **extra)
+
+
+migrate_cli = LazyMigrateGroup("db", help="Perform database migrations (Flask-Migrate).")
+
+
+def register_swagger(app):
+    def swagger_spec():
+        from flask_swagger import swagger
+        return jsonify(swagger(current_app))
+    app.add_url_rule("/swagger.json", "swagger", swagger_spec)
@@ -0,0 +1,166 @@
+"""
+Per-request instrumentation exposed in the Prometheus text format on /metrics.
+
+For every endpoint we record wall time, number of SQL statements, time spent
+in the database and time spent encoding JSON. Requests that run more than
+QUERY_COUNT_WARN_THRESHOLD statements are logged, which is how an N+1 in a
+serialize() path shows up.
+"""
+import os
+import time
+import threading
+from bisect import bisect_left
+from flask import g, request, has_request_context, current_app, Response
+from flask.json.provider import JSONProvider
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            counts, total = self._series.get(label, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._series[label] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {label: (list(counts), total) for label, (counts, total) in self._series.items()}
+        for label, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{endpoint="{label}",le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{endpoint="{label}"}} {total}')
+            lines.append(f'{self.name}_count{{endpoint="{label}"}} {cumulative}')
+        return lines
+
+
+class TimedJSONProvider(JSONProvider):
+    """Wraps the app's JSON provider and adds encoding time to the current request."""
+
+    def __init__(self, app, inner):
+        super().__init__(app)
+        self.inner = inner
+
+    def _timed(self, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if has_request_context() and "metrics_started" in g:
+                g.metrics_json_time += time.perf_counter() - started
+
+    def dumps(self, obj, **kwargs):
+        return self._timed(self.inner.dumps, obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return self.inner.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        return self._timed(self.inner.response, *args, **kwargs)
+
+
+class Metrics:
+
+    def __init__(self):
+        self.duration = Histogram("http_request_duration_seconds", "Wall time per request", LATENCY_BUCKETS)
+        self.statements = Histogram("http_request_sql_statements", "SQL statements per request", COUNT_BUCKETS)
+        self.db_time = Histogram("http_request_db_seconds", "Time spent in SQL per request", LATENCY_BUCKETS)
+        self.json_time = Histogram("http_request_serialization_seconds", "Time spent encoding JSON per request",
+                                   LATENCY_BUCKETS)
+        self.requests = {}
+        self.gauges = []
+        self.warn_threshold = 20
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engines):
+        self.warn_threshold = int(os.getenv("QUERY_COUNT_WARN_THRESHOLD", self.warn_threshold))
+        app.json = TimedJSONProvider(app, app.json)
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.render_response)
+        app.extensions["metrics"] = self
+
+    def gauge(self, name, documentation, func):
+        """Register a value read at scrape time, func returns a number."""
+        self.gauges.append((name, documentation, func))
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        if has_request_context() and "metrics_started" in g:
+            g.metrics_sql_count += 1
+            g.metrics_sql_time += elapsed
+
+    @staticmethod
+    def _before_request():
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_time = 0.0
+        g.metrics_json_time = 0.0
+
+    @staticmethod
+    def _after_request(response):
+        g.metrics_status = response.status_code
+        g.metrics_streamed = response.is_streamed
+        return response
+
+    def _teardown_request(self, error=None):
+        if "metrics_started" not in g or g.get("metrics_recorded") or request.endpoint in (None, "metrics", "static"):
+            return
+        # stream_with_context tears the request down a second time once the body is sent, wait for that one
+        g.metrics_teardowns = g.get("metrics_teardowns", 0) + 1
+        if g.get("metrics_streamed") and g.metrics_teardowns < 2:
+            return
+        g.metrics_recorded = True
+        endpoint = request.endpoint
+        self.duration.observe(endpoint, time.perf_counter() - g.metrics_started)
+        self.statements.observe(endpoint, g.metrics_sql_count)
+        self.db_time.observe(endpoint, g.metrics_sql_time)
+        self.json_time.observe(endpoint, g.metrics_json_time)
+        status = g.get("metrics_status", 500)
+        with self._lock:
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+        if g.metrics_sql_count > self.warn_threshold:
+            current_app.logger.warning("%s %s ran %d SQL statements (threshold %d)", request.method,
+                                       request.full_path, g.metrics_sql_count, self.warn_threshold)
+
+    def render(self):
+        lines = ["# HELP http_requests_total Requests by endpoint and status", "# TYPE http_requests_total counter"]
+        with self._lock:
+            requests = dict(self.requests)
+        for (endpoint, status), count in sorted(requests.items()):
+            lines.append(f'http_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        for histogram in (self.duration, self.statements, self.db_time, self.json_time):
+            lines.extend(histogram.render())
+        for name, documentation, func in self.gauges:
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {func()}"])
+        return "\n".join(lines) + "\n"
+
+    def render_response(self):
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+metrics = Metrics()
@@ -1,14 +1,162 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, select, insert, update, Insert, Update
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement, GenericFunction
+from sqlalchemy.pool import Pool
+from database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores FOREIGN KEY constraints unless asked to, the write handlers rely on them
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+class ChangeCounter(db.Model):
+    """
+    One row, see changes.py. version is the last row_version handed out on dialects that take them from here,
+    and on Postgres the offset added to transaction ids. purged_version is the version tombstones have been
+    purged up to, deleted_version moves past the version of every row deleted outright.
+    """
+    __tablename__ = "change_counter"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+    purged_version = db.Column(db.BigInteger, nullable=False)
+    deleted_version = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+
+@event.listens_for(ChangeCounter.__table__, "after_create")
+def insert_counter_row(target, connection, **kw):
+    # the migrations insert it themselves, this is for databases made by db.create_all()
+    connection.execute(insert(target).values(id=1, version=0, purged_version=0, deleted_version=0))
+
+def counter_value(column):
+    return select(column).where(ChangeCounter.id == 1).scalar_subquery()
+
+class greatest(GenericFunction):
+    type = db.BigInteger()
+    inherit_cache = True
+
+@compiles(greatest, "sqlite")
+def greatest_sqlite(element, compiler, **kw):
+    # SQLite's max() with several arguments
+    return f"max({compiler.process(element.clauses, **kw)})"
+
+class next_row_version(FunctionElement):
+    """
+    The row_version a statement stamps, computed inside the INSERT or UPDATE itself.
+
+    Postgres: the writing transaction's id (plus ChangeCounter.version). Ids are handed
+    out without a lock, so versions don't commit in order, but every transaction below
+    txid_snapshot_xmin() has finished: GET /changes only reads below that (row_version_horizon).
+
+    SQLite: one above the highest version in any versioned table. SQLite runs one write
+    transaction at a time, so versions commit in order.
+
+    Others (MySQL): the counter row, bumped on a transaction's first write and locked
+    until it commits (take_row_version), so versions commit in order there too.
+    """
+    type = db.BigInteger()
+    inherit_cache = True
+
+@compiles(next_row_version)
+def next_row_version_default(element, compiler, **kw):
+    return compiler.process(counter_value(ChangeCounter.version), **kw)
+
+@compiles(next_row_version, "postgresql")
+def next_row_version_postgresql(element, compiler, **kw):
+    offset = func.coalesce(counter_value(ChangeCounter.version), 0)
+    return compiler.process(func.txid_current() + offset, **kw)
+
+@compiles(next_row_version, "sqlite")
+def next_row_version_sqlite(element, compiler, **kw):
+    # deleted and purged rows count too, their versions are never handed out again
+    latest = [func.coalesce(select(func.max(model.row_version)).scalar_subquery(), 0)
+              for model in Versioned.__subclasses__()]
+    latest += [func.coalesce(counter_value(ChangeCounter.deleted_version), 0),
+               func.coalesce(counter_value(ChangeCounter.purged_version), 0)]
+    return compiler.process(greatest(*latest) + 1, **kw)
+
+class row_version_horizon(FunctionElement):
+    """Versions below it can't show up any more; NULL where versions already commit in order."""
+    type = db.BigInteger()
+    inherit_cache = True
+
+@compiles(row_version_horizon)
+def row_version_horizon_default(element, compiler, **kw):
+    return "NULL"
+
+@compiles(row_version_horizon, "postgresql")
+def row_version_horizon_postgresql(element, compiler, **kw):
+    offset = func.coalesce(counter_value(ChangeCounter.version), 0)
+    return compiler.process(func.txid_snapshot_xmin(func.txid_current_snapshot()) + offset, **kw)
+
+INLINE_VERSIONS = ("postgresql", "sqlite")
+
+@event.listens_for(Engine, "before_execute")
+def take_row_version(connection, clauseelement, multiparams, params, execution_options):
+    """Where versions come from the counter row, bumps it before the first INSERT or UPDATE of a versioned table."""
+    if connection.dialect.name in INLINE_VERSIONS or "row_version" in connection.info:
+        return
+    if not isinstance(clauseelement, (Insert, Update)) or "row_version" not in clauseelement.table.c:
+        return
+    counter = ChangeCounter.__table__
+    bump = update(counter).where(counter.c.id == 1).values(version=counter.c.version + 1)
+    if connection.dialect.update_returning:
+        version = connection.execute(bump.returning(counter.c.version)).scalar()
+    elif connection.execute(bump).rowcount:
+        version = connection.execute(select(counter.c.version).where(counter.c.id == 1)).scalar()
+    else:
+        version = None
+    if version is None:
+        # a database made by db.create_all() rather than the migrations starts without the row
+        connection.execute(insert(counter).values(id=1, version=1, purged_version=0))
+        version = 1
+    connection.info["row_version"] = version
+
+@event.listens_for(Engine, "commit")
+@event.listens_for(Engine, "rollback")
+def forget_row_version(connection):
+    connection.info.pop("row_version", None)
+
+@event.listens_for(Pool, "checkin")
+def forget_row_version_on_checkin(dbapi_connection, connection_record):
+    # connection.info above is this record's info, it outlives the checkout
+    connection_record.info.pop("row_version", None)
+
+class Versioned:
+    """row_version and updated_at, set on every INSERT and UPDATE of the row."""
+    row_version = db.Column(db.BigInteger, nullable=False, default=next_row_version(), onupdate=next_row_version())
+    updated_at = db.Column(db.DateTime, nullable=False, default=func.now(), onupdate=func.now())
+
+@event.listens_for(Versioned, "after_delete", propagate=True)
+def count_deleted_row(mapper, connection, target):
+    # a row deleted outright (the admin) no longer shows in its table, deleted_version moves instead:
+    # every delete changes it, and it stays at or above the versions of deleted rows
+    counter = ChangeCounter.__table__
+    moved = greatest(target.row_version, counter.c.deleted_version + 1)
+    connection.execute(update(counter).where(counter.c.id == 1).values(deleted_version=moved))
+
+class User(Versioned, db.Model):
+    # not in GET /changes, the versions are for the ETags of the user routes
+    __table_args__ = (
+        db.Index("ix_user_row_version_id", "row_version", "id"),
+    )
 
-class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(80), unique=False, nullable=False)
     is_active = db.Column(db.Boolean, unique=False, nullable=False, default=True)
 
+    # GET /users only pages by id, password stays out of fields=
+    public_fields = ("id", "username", "email")
+
     #Relationships 
     favorite_people = db.relationship("Favorite_People", backref="user_favorite_people", lazy=True)
     favorite_planet = db.relationship("Favorite_Planet", backref="user_favorite_planet", lazy=True)
@@ -22,11 +170,24 @@ class User(db.Model):
             "username": self.username,
             "email": self.email,
         }
+
+    def serialize_favorites(self):
+        return {
+            "people": [favorite.favorite_people.serialize() for favorite in self.favorite_people],
+            "planets": [favorite.favorite_planet.serialize() for favorite in self.favorite_planet]
+        }
     
-class Favorite_People(db.Model):
+class Favorite_People(Versioned, db.Model):
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "people_id", name="uq_favorite_people_user_id_people_id"),
+        db.Index("ix_favorite_people_row_version_id", "row_version", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     people_id = db.Column(db.Integer, db.ForeignKey("people.id"))
+    # set instead of deleting the row, so GET /changes can report the removal
+    deleted_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f"<Person: {self.id}>"
@@ -38,10 +199,17 @@ class Favorite_People(db.Model):
             "people_id": self.people_id
         }
 
-class Favorite_Planet(db.Model):
+class Favorite_Planet(Versioned, db.Model):
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "planet_id", name="uq_favorite_planet_user_id_planet_id"),
+        db.Index("ix_favorite_planet_row_version_id", "row_version", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     planet_id = db.Column(db.Integer, db.ForeignKey("planets.id"))
+    # set instead of deleting the row, so GET /changes can report the removal
+    deleted_at = db.Column(db.DateTime, nullable=True)
     
     def __repr__(self):
         return f"<Planet: {self.id}>"
@@ -53,11 +221,24 @@ class Favorite_Planet(db.Model):
             "planet_id": self.planet_id
         }
 
-class People(db.Model):
+class People(Versioned, db.Model):
+    __table_args__ = (
+        db.Index("ix_people_height_id", "height", "id"),
+        db.Index("ix_people_mass_id", "mass", "id"),
+        db.Index("ix_people_favorite_count_id", "favorite_count", "id"),
+        db.Index("ix_people_row_version_id", "row_version", "id"),
+    )
+    # query string options of GET /people, see utils.ListQuery
+    public_fields = ("id", "name", "height", "mass")
+    range_filters = ("height", "mass")
+    sortable = ("id", "name", "height", "mass")
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False) 
     height = db.Column(db.Integer, nullable=False)
     mass = db.Column(db.Integer, nullable=False)
+    # rows in favorite__people pointing here, maintained by the favorite handlers (see popularity.py)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     #relationship
     favorite_people = db.relationship("Favorite_People", backref="favorite_people", lazy=True)
@@ -74,11 +255,24 @@ class People(db.Model):
         }
 
 
-class Planets(db.Model):
+class Planets(Versioned, db.Model):
+    __table_args__ = (
+        db.Index("ix_planets_orbital_period_id", "orbital_period", "id"),
+        db.Index("ix_planets_population_id", "population", "id"),
+        db.Index("ix_planets_favorite_count_id", "favorite_count", "id"),
+        db.Index("ix_planets_row_version_id", "row_version", "id"),
+    )
+    # query string options of GET /planets, see utils.ListQuery
+    public_fields = ("id", "name", "orbital_period", "population")
+    range_filters = ("orbital_period", "population")
+    sortable = ("id", "name", "orbital_period", "population")
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     orbital_period = db.Column(db.Integer, nullable=False)
     population = db.Column(db.Integer, nullable=False)
+    # rows in favorite__planet pointing here, maintained by the favorite handlers (see popularity.py)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     favorite_planet = db.relationship("Favorite_Planet", backref="favorite_planet", lazy=True)
 
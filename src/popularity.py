@@ -0,0 +1,140 @@
+"""
+Most favorited people and planets for GET /people/popular and /planets/popular.
+
+People.favorite_count and Planets.favorite_count are kept in step with the
+favorites tables by the handlers that write them, in the same transaction.
+Every worker holds the top POPULAR_TOP_K rows of each in memory: loaded with
+one ORDER BY favorite_count DESC LIMIT query on the (favorite_count, id) index,
+patched as its own handlers change counts, and reloaded when a change could
+have reordered rows it doesn't hold, or after POPULAR_REFRESH_INTERVAL seconds
+to pick up other workers' writes. Serving a leaderboard is a slice of that list.
+
+    $ flask popularity reconcile
+
+recounts both columns from the favorites tables.
+"""
+import os
+import time
+import threading
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, update, func
+from models import db, People, Planets, Favorite_People, Favorite_Planet
+
+POPULAR_TOP_K = int(os.getenv("POPULAR_TOP_K", 100))
+POPULAR_REFRESH_INTERVAL = float(os.getenv("POPULAR_REFRESH_INTERVAL", 5))
+
+# counted model, favorites model, its foreign key to the counted model
+COUNTED = (
+    (People, Favorite_People, "people_id"),
+    (Planets, Favorite_Planet, "planet_id"),
+)
+
+
+def unchanged(model):
+    # favorite_count isn't part of the public row, so writing it leaves the row out of GET /changes
+    return {"row_version": model.row_version, "updated_at": model.updated_at}
+
+def bump(model, id, delta):
+    """Adjusts favorite_count inside the caller's transaction."""
+    db.session.execute(update(model).where(model.id == id)
+                       .values(favorite_count=model.favorite_count + delta, **unchanged(model)))
+
+def recount(model, ids=None):
+    """Sets favorite_count from the favorites table for ids (every row when None), returns how many changed."""
+    favorite_model, key = next((favorites, key) for counted, favorites, key in COUNTED if counted is model)
+    actual = (select(func.count(favorite_model.id))
+              .where(getattr(favorite_model, key) == model.id, favorite_model.deleted_at.is_(None))
+              .scalar_subquery())
+    statement = update(model).where(model.favorite_count != actual).values(favorite_count=actual, **unchanged(model))
+    if ids is not None:
+        statement = statement.where(model.id.in_(ids))
+    return db.session.execute(statement).rowcount
+
+
+class Leaderboard:
+
+    def __init__(self, model, size=POPULAR_TOP_K):
+        self.model = model
+        self.size = size
+        self.entries = []
+        # upper bound on the favorite_count of any row not in entries
+        self.outside_max = 0
+        self.stale = True
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        model = self.model
+        columns = [getattr(model, name) for name in model.public_fields] + [model.favorite_count]
+        # both keys descending so the (favorite_count, id) index is read backwards, no sort
+        rows = db.session.execute(select(*columns).where(model.favorite_count > 0)
+                                  .order_by(model.favorite_count.desc(), model.id.desc())
+                                  .limit(self.size + 1)).all()
+        with self._lock:
+            self.entries = [row._asdict() for row in rows[:self.size]]
+            self.outside_max = rows[self.size].favorite_count if len(rows) > self.size else 0
+            self.stale = False
+            self.loaded_at = time.monotonic()
+
+    def changed(self, id, delta):
+        with self._lock:
+            if self.stale:
+                return
+            for index, entry in enumerate(self.entries):
+                if entry["id"] == id:
+                    entry["favorite_count"] += delta
+                    if self.outside_max and entry["favorite_count"] <= self.outside_max:
+                        # a row we don't hold may now rank above it
+                        self.stale = True
+                    elif entry["favorite_count"] <= 0:
+                        del self.entries[index]
+                    else:
+                        self.entries.sort(key=lambda item: (-item["favorite_count"], -item["id"]))
+                    return
+            if delta > 0:
+                self.outside_max += delta
+                if len(self.entries) < self.size or self.outside_max >= self.entries[-1]["favorite_count"]:
+                    self.stale = True
+
+    def mark_stale(self):
+        self.stale = True
+
+    def top(self, limit):
+        if self.stale or time.monotonic() - self.loaded_at > POPULAR_REFRESH_INTERVAL:
+            self.load()
+        with self._lock:
+            return [dict(entry) for entry in self.entries[:limit]]
+
+
+class Popularity:
+
+    def __init__(self):
+        self.boards = {model: Leaderboard(model) for model, _, _ in COUNTED}
+
+    def top(self, model, limit):
+        return self.boards[model].top(min(limit, POPULAR_TOP_K))
+
+    def changed(self, model, id, delta):
+        """Call after the transaction that bumped id's favorite_count by delta has committed."""
+        self.boards[model].changed(id, delta)
+
+    def mark_stale(self, model=None):
+        for board_model, board in self.boards.items():
+            if model is None or board_model is model:
+                board.mark_stale()
+
+
+popularity = Popularity()
+
+cli = AppGroup("popularity", help="Favorite counters behind /people/popular and /planets/popular")
+
+
+@cli.command("reconcile")
+def reconcile_command():
+    """Rebuild favorite_count on people and planets from the favorites tables."""
+    for model, _, _ in COUNTED:
+        fixed = recount(model)
+        db.session.commit()
+        click.echo(f"{model.__tablename__}: {fixed} favorite_count values corrected")
+    popularity.mark_stale()
@@ -0,0 +1,241 @@
+"""
+Per-client rate limiting and load shedding.
+
+Every request takes `cost` tokens from its client's bucket. Buckets hold
+RATE_LIMIT_BURST tokens and refill at RATE_LIMIT_RATE tokens per second; a
+request that finds too few gets 429 with Retry-After. Clients are identified by
+X-API-Key when the key is one of RATE_LIMIT_API_KEYS, otherwise by IP address
+(the X-Forwarded-For entry added by the last RATE_LIMIT_TRUST_PROXY proxies).
+
+Routes declare their cost with @limiter.cost(n), n can also be a function of
+the query string: single-id lookups cost 1, a list page grows with its limit
+and whole-table dumps (?stream=1, /users/favorites) cost the most.
+
+Buckets live in process memory unless RATE_LIMIT_URL points at Redis, which
+shares them between workers. Any object with the same take() method can stand
+in for either backend.
+
+Independently of the buckets, at most MAX_CONCURRENT_REQUESTS requests run at
+once per worker (default DB_POOL_SIZE + DB_MAX_OVERFLOW, 0 disables); the next
+one is answered 503 straight away instead of queueing for a pool connection.
+"""
+import os
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request, jsonify, g, current_app
+from utils import wants_stream, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+STREAM_COST = 20
+EXEMPT_ENDPOINTS = ("metrics", "static")
+
+
+class MemoryBuckets:
+    """Per-process token buckets, the least recently seen clients are dropped past max_clients."""
+
+    local = True
+
+    def __init__(self, max_clients=100000):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """Returns 0 when the tokens were taken, otherwise the seconds until they would be available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Same arithmetic as MemoryBuckets.take, run atomically in Redis on its own clock
+TAKE_SCRIPT = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Buckets shared by every worker. Any client with redis-py's eval() works."""
+
+    local = False
+
+    def __init__(self, client, prefix="swapi:rl:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def take(self, key, cost, rate, burst):
+        return float(self.client.eval(TAKE_SCRIPT, 1, self.prefix + key, rate, burst, cost))
+
+
+def list_cost(args, streamed):
+    # one token per DEFAULT_PAGE_SIZE rows on top of the request itself
+    if streamed:
+        return STREAM_COST
+    if args.get("ids"):
+        limit = args["ids"].count(",") + 1
+    else:
+        limit = args.get("limit", DEFAULT_PAGE_SIZE, type=int) or DEFAULT_PAGE_SIZE
+    return 1 + min(max(limit, 1), MAX_PAGE_SIZE) // DEFAULT_PAGE_SIZE
+
+
+class RateLimiter:
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.enabled = True
+        self.rate = 20.0
+        self.burst = 100.0
+        self.api_keys = frozenset()
+        self.trusted_proxies = 0
+        self.slots = None
+        self.limited = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        default_slots = int(os.getenv("DB_POOL_SIZE", 5)) + int(os.getenv("DB_MAX_OVERFLOW", 10))
+        app.config.setdefault("RATE_LIMIT_ENABLED", os.getenv("RATE_LIMIT_ENABLED", "1") == "1")
+        app.config.setdefault("RATE_LIMIT_URL", os.getenv("RATE_LIMIT_URL"))
+        app.config.setdefault("RATE_LIMIT_RATE", float(os.getenv("RATE_LIMIT_RATE", self.rate)))
+        app.config.setdefault("RATE_LIMIT_BURST", float(os.getenv("RATE_LIMIT_BURST", self.burst)))
+        app.config.setdefault("RATE_LIMIT_API_KEYS", os.getenv("RATE_LIMIT_API_KEYS", ""))
+        app.config.setdefault("RATE_LIMIT_TRUST_PROXY", int(os.getenv("RATE_LIMIT_TRUST_PROXY", 0)))
+        app.config.setdefault("MAX_CONCURRENT_REQUESTS", int(os.getenv("MAX_CONCURRENT_REQUESTS", default_slots)))
+        self.enabled = app.config["RATE_LIMIT_ENABLED"]
+        self.rate = app.config["RATE_LIMIT_RATE"]
+        self.burst = app.config["RATE_LIMIT_BURST"]
+        self.api_keys = frozenset(key.strip() for key in app.config["RATE_LIMIT_API_KEYS"].split(",") if key.strip())
+        self.trusted_proxies = app.config["RATE_LIMIT_TRUST_PROXY"]
+        if app.config["MAX_CONCURRENT_REQUESTS"] > 0:
+            self.slots = threading.BoundedSemaphore(app.config["MAX_CONCURRENT_REQUESTS"])
+        if self.backend is None:
+            if app.config["RATE_LIMIT_URL"]:
+                self.backend = RedisBuckets.from_url(app.config["RATE_LIMIT_URL"])
+            else:
+                self.backend = MemoryBuckets()
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions["rate_limiter"] = self
+
+    @staticmethod
+    def cost(value):
+        """Tokens a view takes per request: a number, or a function of (args, streamed)."""
+        def decorator(view):
+            # functools.wraps copies the attribute up through the other decorators
+            view.rate_limit_cost = value
+            return view
+        return decorator
+
+    @staticmethod
+    def cost_of(view, args, streamed):
+        value = getattr(view, "rate_limit_cost", 1)
+        return value(args, streamed) if callable(value) else value
+
+    def client_key(self, api_key, remote_addr, forwarded_for=None):
+        if api_key and api_key in self.api_keys:
+            # keys are hashed so they never sit in memory or Redis in the clear
+            return "key:" + hashlib.sha1(api_key.encode()).hexdigest()
+        if self.trusted_proxies and forwarded_for:
+            hops = [hop.strip() for hop in forwarded_for.split(",")]
+            if len(hops) >= self.trusted_proxies:
+                remote_addr = hops[-self.trusted_proxies]
+        return f"ip:{remote_addr}"
+
+    def request_client(self):
+        return self.client_key(request.headers.get("X-API-Key"), request.remote_addr,
+                               request.headers.get("X-Forwarded-For"))
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def admit(self, client, cost):
+        """None when the request may run (holding a slot until release()), else (body, status, retry_after)."""
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            self._count("shed")
+            return {"error": "Server busy, try again later"}, 503, 1
+        if self.enabled:
+            # a cost above the burst could never be paid, charge a full bucket instead
+            wait = self.backend.take(client, min(cost, self.burst), self.rate, self.burst)
+            if wait > 0:
+                self.release()
+                self._count("limited")
+                return {"error": "Too many requests"}, 429, math.ceil(wait)
+        return None
+
+    def release(self):
+        if self.slots is not None:
+            self.slots.release()
+
+    def _before_request(self):
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        client = self.request_client()
+        rejected = self.admit(client, self.cost_of(view, request.args, wants_stream()))
+        if rejected is not None:
+            body, status, retry_after = rejected
+            return jsonify(body), status, {"Retry-After": str(retry_after)}
+        g.rate_limit_slot = True
+        return None
+
+    @staticmethod
+    def _after_request(response):
+        g.rate_limit_streamed = response.is_streamed
+        return response
+
+    def _teardown_request(self, error=None):
+        if not g.get("rate_limit_slot"):
+            return
+        # a streamed body still holds its connection until the second teardown, see metrics.py
+        if g.get("rate_limit_streamed") and not g.get("rate_limit_torn_down"):
+            g.rate_limit_torn_down = True
+            return
+        g.rate_limit_slot = False
+        self.release()
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "enabled": self.enabled,
+            "rate": self.rate,
+            "burst": self.burst,
+            "limited": self.limited,
+            "shed": self.shed,
+        }
+
+
+limiter = RateLimiter()
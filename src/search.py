@@ -0,0 +1,222 @@
+"""
+Name search over People and Planets for GET /search?q=
+
+Results are ranked exact match > prefix > substring > fuzzy (trigram similarity).
+The default backend keeps every name in memory: a sorted list answers prefix
+lookups with a binary search and a trigram inverted index answers substring
+and fuzzy lookups. It is built on the first search, add_person/add_planet
+insert into it directly and rows written by other workers are picked up by an
+id > max_id catch-up query at most every SEARCH_REFRESH_INTERVAL seconds.
+Renames and deletes (only the admin makes them) update the worker that made
+them, the catch-up query only sees new ids.
+
+On Postgres with the pg_trgm extension installed the same ranking runs in SQL
+against the GIN trigram indexes instead (SEARCH_BACKEND=auto|memory|postgres).
+"""
+import os
+import math
+import time
+import threading
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from sqlalchemy import text
+from models import db, People, Planets
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+SEARCH_REFRESH_INTERVAL = float(os.getenv("SEARCH_REFRESH_INTERVAL", 5))
+FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", 0.3))
+KINDS = {"person": People, "planet": Planets}
+
+EXACT, PREFIX, SUBSTRING, FUZZY = 3, 2, 1, 0
+
+
+def trigrams(value):
+    # one space of padding rather than pg_trgm's two: "  x" would list 1/26th of all names
+    # and prefix lookups are served by the sorted list anyway
+    padded = f" {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+
+    def __init__(self):
+        self.names = {}
+        self.gram_counts = {}
+        self.sorted_names = []
+        self.postings = defaultdict(set)
+        self.max_ids = {kind: 0 for kind in KINDS}
+        self.built = False
+        self.refreshed_at = 0.0
+        self._lock = threading.RLock()
+
+    def _insert(self, kind, id, name):
+        key = (kind, id)
+        if key in self.names:
+            return
+        lower = name.lower()
+        grams = trigrams(lower)
+        self.names[key] = name
+        self.gram_counts[key] = len(grams)
+        for gram in grams:
+            self.postings[gram].add(key)
+        self.max_ids[kind] = max(self.max_ids[kind], id)
+        return lower
+
+    def add(self, kind, id, name):
+        with self._lock:
+            lower = self._insert(kind, id, name)
+            if lower is not None:
+                insort(self.sorted_names, (lower, kind, id))
+
+    def remove(self, kind, id):
+        with self._lock:
+            key = (kind, id)
+            name = self.names.pop(key, None)
+            if name is None:
+                return
+            del self.gram_counts[key]
+            lower = name.lower()
+            for gram in trigrams(lower):
+                self.postings[gram].discard(key)
+            position = bisect_left(self.sorted_names, (lower, kind, id))
+            if position < len(self.sorted_names) and self.sorted_names[position] == (lower, kind, id):
+                del self.sorted_names[position]
+
+    def _load(self, after_ids, rows):
+        # appends to rows as it goes, so a load cut short by an error still leaves
+        # everything it indexed in rows for the caller to add to sorted_names
+        for kind, model in KINDS.items():
+            query = db.session.query(model.id, model.name).filter(model.id > after_ids[kind])
+            for id, name in query.yield_per(10000):
+                lower = self._insert(kind, id, name)
+                if lower is not None:
+                    rows.append((lower, kind, id))
+
+    def build(self):
+        with self._lock:
+            # another request built it while this one waited for the lock
+            if self.built:
+                return
+            rows = []
+            try:
+                self._load(dict(self.max_ids), rows)
+            finally:
+                # _load skips names already indexed, so add to sorted_names, never replace it
+                self.sorted_names.extend(rows)
+                self.sorted_names.sort()
+            self.built = True
+            self.refreshed_at = time.monotonic()
+
+    def catch_up(self):
+        with self._lock:
+            rows = []
+            try:
+                self._load(dict(self.max_ids), rows)
+            finally:
+                for row in rows:
+                    insort(self.sorted_names, row)
+            self.refreshed_at = time.monotonic()
+
+    def mark_stale(self):
+        self.refreshed_at = 0.0
+
+    def ensure_fresh(self):
+        # build() checks again under the lock, concurrent first searches build once
+        if not self.built:
+            self.build()
+        elif time.monotonic() - self.refreshed_at > SEARCH_REFRESH_INTERVAL:
+            self.catch_up()
+
+    def search(self, q, limit=20):
+        q = q.strip().lower()
+        if not q:
+            return []
+        matches = {}
+        with self._lock:
+            start = bisect_left(self.sorted_names, (q,))
+            for lower, kind, id in self.sorted_names[start:start + limit]:
+                if not lower.startswith(q):
+                    break
+                matches[(kind, id)] = (EXACT if lower == q else PREFIX, len(q) / len(lower))
+
+            # prefix matches outrank everything else, a full page of them needs no trigram work
+            if len(q) >= 3 and len(matches) < limit:
+                grams = trigrams(q)
+                # similarity >= FUZZY_THRESHOLD needs at least this many shared trigrams
+                min_shared = max(1, math.ceil(FUZZY_THRESHOLD * len(grams) / (1 + FUZZY_THRESHOLD)))
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self.postings.get(gram, ()))
+                for key, count in shared.items():
+                    if count < min_shared or key in matches:
+                        continue
+                    similarity = count / (len(grams) + self.gram_counts[key] - count)
+                    if q in self.names[key].lower():
+                        matches[key] = (SUBSTRING, similarity)
+                    elif similarity >= FUZZY_THRESHOLD:
+                        matches[key] = (FUZZY, similarity)
+
+            ranked = sorted(matches.items(), key=lambda item: (-item[1][0], -item[1][1], item[0][1]))[:limit]
+            return [result(kind, id, self.names[(kind, id)], tier + similarity)
+                    for (kind, id), (tier, similarity) in ranked]
+
+
+def result(kind, id, name, score):
+    return {"type": kind, "id": id, "name": name, "score": round(score, 4)}
+
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+PG_SEARCH = text("""
+    SELECT kind, id, name,
+           CASE WHEN lower(name) = lower(:q) THEN 3
+                WHEN name ILIKE :prefix THEN 2
+                WHEN name ILIKE :contains THEN 1
+                ELSE 0 END + similarity(name, :q) AS score
+    FROM (
+        SELECT 'person' AS kind, id, name FROM people WHERE name ILIKE :contains OR name % :q
+        UNION ALL
+        SELECT 'planet' AS kind, id, name FROM planets WHERE name ILIKE :contains OR name % :q
+    ) AS matches
+    ORDER BY score DESC, id
+    LIMIT :limit
+""")
+
+
+class NameSearch:
+
+    def __init__(self):
+        self.index = NameIndex()
+        self._use_postgres = None
+
+    def use_postgres(self):
+        if self._use_postgres is None:
+            if SEARCH_BACKEND == "memory" or db.engine.dialect.name != "postgresql":
+                self._use_postgres = False
+            else:
+                installed = db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+                self._use_postgres = installed is not None or SEARCH_BACKEND == "postgres"
+        return self._use_postgres
+
+    def add(self, kind, id, name):
+        if self.index.built:
+            self.index.add(kind, id, name)
+
+    def remove(self, kind, id):
+        self.index.remove(kind, id)
+
+    def mark_stale(self):
+        self.index.mark_stale()
+
+    def search(self, q, limit=20):
+        if self.use_postgres():
+            pattern = escape_like(q.strip())
+            rows = db.session.execute(PG_SEARCH, {"q": q.strip(), "prefix": f"{pattern}%",
+                                                  "contains": f"%{pattern}%", "limit": limit})
+            return [result(row.kind, row.id, row.name, float(row.score)) for row in rows]
+        self.index.ensure_fresh()
+        return self.index.search(q, limit)
+
+
+name_search = NameSearch()
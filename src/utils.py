@@ -1,4 +1,18 @@
-from flask import jsonify, url_for
+import os
+from flask import jsonify, url_for, request, json, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select, tuple_, types as db_types
+from models import db
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 1000))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +29,218 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    orjson when it is installed, Flask's stdlib json provider otherwise. Dates and
+    times still go through Flask's default (HTTP dates), so both decode to the same
+    values; the bytes differ in that orjson writes non-ASCII text as UTF-8 where
+    the stdlib escapes it as \\uXXXX.
+    """
+
+    def _options(self):
+        # PASSTHROUGH_DATETIME: orjson would write ISO 8601, Flask's default writes HTTP dates
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        return options | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # keep the stdlib path whenever Flask would pretty print (debug mode or compact=False)
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options())
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+def get_page_args(args=None):
+    # ?limit=&after=<cursor>, limit is clamped to MAX_PAGE_SIZE
+    args = request.args if args is None else args
+    limit = int_arg(args, "limit")
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    elif limit < 1:
+        raise APIException("limit must be a positive integer", status_code=400)
+    return min(limit, MAX_PAGE_SIZE), args.get("after", None)
+
+def int_arg(args, name):
+    value = args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise APIException(f"{name} must be an integer", status_code=400)
+
+def parse_ids(raw):
+    # "1,2,3" from the query string or a JSON list; repeated ids are dropped, the first one keeps its place
+    values = raw.split(",") if isinstance(raw, str) else raw
+    if not isinstance(values, list) or any(isinstance(value, bool) for value in values):
+        raise APIException("ids must be a list of integers", status_code=400)
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values if str(value).strip()))
+    except (TypeError, ValueError):
+        raise APIException("ids must be a list of integers", status_code=400)
+    if not ids:
+        raise APIException("ids is empty", status_code=400)
+    if len(ids) > MAX_PAGE_SIZE:
+        raise APIException(f"At most {MAX_PAGE_SIZE} ids per request", status_code=413)
+    return ids
+
+def by_ids_statement(model, ids):
+    return select(*[getattr(model, name) for name in model.public_fields]).where(model.id.in_(ids))
+
+def in_requested_order(found, ids):
+    """found maps id -> serialized row, returns (rows in the order of ids, ids that don't exist)"""
+    return [found[id] for id in ids if id in found], [id for id in ids if id not in found]
+
+def serialize_row(row):
+    # ORM objects know how to serialize themselves, projected rows are already just the requested columns
+    if hasattr(row, "serialize"):
+        return row.serialize()
+    return row._asdict()
+
+def wants_stream(args=None, accept_mimetypes=None):
+    args = request.args if args is None else args
+    accept_mimetypes = request.accept_mimetypes if accept_mimetypes is None else accept_mimetypes
+    if args.get("stream") in ("1", "true"):
+        return True
+    return accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+class ListQuery:
+    """
+    Query string options shared by the list endpoints:
+
+        <column>_min / <column>_max   range filters on the model's range_filters
+        name_prefix                   name LIKE 'prefix%'
+        sort=<column> / sort=-<column>  any of the model's sortable columns, id breaks ties
+        fields=a,b                    only load and return these columns (id and the sort column are always included),
+                                      defaults to the model's public_fields
+
+    Pages are keyset paginated on (sort column, id), so the cursor is the id when
+    sorting by id and "<value>,<id>" otherwise. The query is a plain select() so
+    the async entry point (asgi.py) runs exactly the same statements.
+    """
+
+    def __init__(self, model, statement=None, sort_column=None, descending=False):
+        self.model = model
+        self.statement = select(model) if statement is None else statement
+        self.sort_column = model.id if sort_column is None else sort_column
+        self.descending = descending
+
+    @classmethod
+    def from_request(cls, model, args=None):
+        args = request.args if args is None else args
+        conditions = []
+        for name in getattr(model, "range_filters", ()):
+            column = getattr(model, name)
+            low, high = int_arg(args, f"{name}_min"), int_arg(args, f"{name}_max")
+            if low is not None:
+                conditions.append(column >= low)
+            if high is not None:
+                conditions.append(column <= high)
+
+        prefix = args.get("name_prefix")
+        if prefix and hasattr(model, "name"):
+            conditions.append(model.name.startswith(prefix, autoescape=True))
+
+        sort = args.get("sort", "id")
+        descending = sort.startswith("-")
+        sort_name = sort.lstrip("-")
+        if sort_name not in getattr(model, "sortable", ("id",)):
+            raise APIException(f"Can't sort by {sort_name}", status_code=400)
+
+        # Lists always select plain column tuples: no ORM instances, identity map or serialize() per row
+        fields = args.get("fields")
+        names = list(model.public_fields)
+        if fields:
+            names = [name.strip() for name in fields.split(",") if name.strip()]
+            unknown = [name for name in names if name not in model.public_fields]
+            if unknown:
+                raise APIException(f"Unknown fields: {', '.join(unknown)}", status_code=400)
+            for required in (sort_name, "id"):
+                if required not in names:
+                    names.insert(0, required)
+        statement = select(*[getattr(model, name) for name in names]).where(*conditions)
+
+        return cls(model, statement, getattr(model, sort_name), descending)
+
+    @property
+    def keys(self):
+        if self.sort_column is self.model.id:
+            return (self.model.id,)
+        return (self.sort_column, self.model.id)
+
+    def parse_cursor(self, after):
+        try:
+            if len(self.keys) == 1:
+                return int(after)
+            value, id = after.rsplit(",", 1)
+            if not isinstance(self.sort_column.type, db_types.String):
+                value = int(value)
+            return (value, int(id))
+        except ValueError:
+            raise APIException("Invalid cursor in after", status_code=400)
+
+    def cursor(self, row):
+        if len(self.keys) == 1:
+            return row.id
+        return f"{getattr(row, self.sort_column.key)},{row.id}"
+
+    def keyset(self, after=None):
+        # Seek past the cursor instead of OFFSET so every page is an index range scan
+        statement = self.statement
+        if after is not None:
+            bound = self.keys[0] if len(self.keys) == 1 else tuple_(*self.keys)
+            cursor = self.parse_cursor(after)
+            statement = statement.where(bound < cursor if self.descending else bound > cursor)
+        return statement.order_by(*[key.desc() if self.descending else key for key in self.keys])
+
+    def page_statement(self, limit, after=None):
+        # one row past the page tells us whether there is a next one
+        return self.keyset(after).limit(limit + 1)
+
+    def split_page(self, rows, limit):
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.cursor(rows[-1])
+        return rows, next_cursor
+
+    def page(self, limit, after=None):
+        rows = db.session.execute(self.page_statement(limit, after)).all()
+        return self.split_page(rows, limit)
+
+    def stream(self, after=None):
+        # One JSON document per line, rows fetched in STREAM_BATCH_SIZE chunks through a server-side cursor
+        statement = self.keyset(after).execution_options(yield_per=STREAM_BATCH_SIZE)
+        session = db.session()
+
+        def generate():
+            try:
+                for row in session.execute(statement):
+                    yield json.dumps(serialize_row(row)) + "\n"
+            finally:
+                # the request's session is torn down before the body is sent, so nothing else returns this connection
+                session.close()
+
+        return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if app.config.get('ADMIN_ENABLED') else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -0,0 +1,323 @@
+"""
+Write-behind for favorite adds and removes (FAVORITES_WRITE_BEHIND=1).
+
+Instead of a transaction per toggle, POST /favorite/people|planets and the
+DELETE routes append the change to a journal, a SQLite file on local disk
+(WRITE_BEHIND_JOURNAL), and answer 202 once it is committed there. A background
+thread in every worker applies the journal every WRITE_BEHIND_FLUSH_INTERVAL
+seconds, WRITE_BEHIND_BATCH_SIZE entries per database transaction:
+
+- Only the last change per (user, item) is kept, so an add followed by a remove
+  writes nothing at all. A pair's earlier entries are dropped when a new one is
+  queued, and a batch keeps the last entry of each pair it reads.
+- Adds go through insert_or_revive in one executemany and removes set deleted_at
+  with one UPDATE, one transaction per batch. favorite_count is recounted for
+  the items the batch touched, as /favorites/bulk does.
+- Adds naming a user or item that doesn't exist are dropped, so they can't fail
+  the rest of the batch. A batch that still hits an integrity error is retried
+  entry by entry.
+
+Workers on the same host share the journal. A lease row makes sure only one
+worker flushes at a time, so changes are applied in the order they were queued.
+Every entry is a final state, so applying one twice changes nothing; a worker
+killed between the database commit and the journal delete loses nothing.
+
+Backpressure: with WRITE_BEHIND_MAX_PENDING entries waiting, new writes get 503
+with Retry-After instead of growing the journal. On shutdown the journal is
+drained, from gunicorn's worker_exit hook (gunicorn.conf.py) or at exit:
+
+    $ flask favorites drain
+
+Until a change is flushed, reads (GET /users/<id>/favorites, /changes, the
+popular lists) don't show it.
+"""
+import os
+import time
+import atexit
+import socket
+import sqlite3
+import threading
+import click
+from flask import jsonify
+from flask.cli import AppGroup
+from sqlalchemy import update, tuple_, func
+from sqlalchemy.exc import IntegrityError
+from database import insert_or_revive
+from popularity import popularity, recount
+from bulk import existing
+from models import db, User, Favorite_People, Favorite_Planet, People, Planets
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+ADD, REMOVE = "add", "remove"
+# journal kind: favorites model, counted model, foreign key to it
+KINDS = {
+    "people": (Favorite_People, People, "people_id"),
+    "planets": (Favorite_Planet, Planets, "planet_id"),
+}
+# a flusher that died holding the lease is replaced after this long
+LEASE_SECONDS = 30
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS favorite_ops (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        queued_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_favorite_ops_pair ON favorite_ops (kind, user_id, item_id)",
+    "CREATE TABLE IF NOT EXISTS flush_lease (id INTEGER PRIMARY KEY, owner TEXT, expires_at REAL NOT NULL)",
+    "INSERT OR IGNORE INTO flush_lease (id, owner, expires_at) VALUES (1, NULL, 0)",
+)
+
+
+class FavoritesQueue:
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.path = None
+        self.flush_interval = 0.5
+        self.batch_size = 500
+        self.max_pending = 10000
+        self.drain_timeout = 20.0
+        self.queued = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        app.config.setdefault("FAVORITES_WRITE_BEHIND", os.getenv("FAVORITES_WRITE_BEHIND", "0") == "1")
+        app.config.setdefault("WRITE_BEHIND_JOURNAL",
+                              os.getenv("WRITE_BEHIND_JOURNAL", os.path.join(ROOT, "favorites-journal.db")))
+        app.config.setdefault("WRITE_BEHIND_FLUSH_INTERVAL",
+                              float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", self.flush_interval)))
+        app.config.setdefault("WRITE_BEHIND_BATCH_SIZE", int(os.getenv("WRITE_BEHIND_BATCH_SIZE", self.batch_size)))
+        app.config.setdefault("WRITE_BEHIND_MAX_PENDING", int(os.getenv("WRITE_BEHIND_MAX_PENDING", self.max_pending)))
+        app.config.setdefault("WRITE_BEHIND_DRAIN_TIMEOUT",
+                              float(os.getenv("WRITE_BEHIND_DRAIN_TIMEOUT", self.drain_timeout)))
+        self.enabled = app.config["FAVORITES_WRITE_BEHIND"]
+        self.app = app
+        self.path = app.config["WRITE_BEHIND_JOURNAL"]
+        self.flush_interval = app.config["WRITE_BEHIND_FLUSH_INTERVAL"]
+        self.batch_size = app.config["WRITE_BEHIND_BATCH_SIZE"]
+        self.max_pending = app.config["WRITE_BEHIND_MAX_PENDING"]
+        self.drain_timeout = app.config["WRITE_BEHIND_DRAIN_TIMEOUT"]
+        app.extensions["favorites_queue"] = self
+        if self.enabled:
+            # the flusher is a thread of the worker, started by its first request (threads don't survive --preload's fork)
+            app.before_request(self.start)
+
+    # journal
+
+    def journal(self):
+        """This thread's connection to the journal, opened again in a forked child."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # WAL lets requests queue while a flush reads; FULL syncs each commit, the 202 means it is on disk
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            local.connection, local.pid = connection, os.getpid()
+        return local.connection
+
+    def pending(self):
+        if not self.enabled:
+            return 0
+        return self.journal().execute("SELECT count(*) FROM favorite_ops").fetchone()[0]
+
+    def _count(self, name, count=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def enqueue(self, kind, user_id, item_id, op):
+        """Appends one change, replacing the pair's earlier ones; False when the journal is full."""
+        journal = self.journal()
+        journal.execute("BEGIN IMMEDIATE")
+        try:
+            if journal.execute("SELECT count(*) FROM favorite_ops").fetchone()[0] >= self.max_pending:
+                journal.execute("ROLLBACK")
+                return False
+            replaced = journal.execute("DELETE FROM favorite_ops WHERE kind = ? AND user_id = ? AND item_id = ?",
+                                       (kind, user_id, item_id)).rowcount
+            journal.execute("INSERT INTO favorite_ops (kind, user_id, item_id, op, queued_at) VALUES (?, ?, ?, ?, ?)",
+                            (kind, user_id, item_id, op, time.time()))
+            journal.execute("COMMIT")
+        except BaseException:
+            journal.execute("ROLLBACK")
+            raise
+        self._count("queued")
+        self._count("coalesced", replaced)
+        return True
+
+    def submit(self, kind, user_id, item_id, op):
+        """The response for a favorite write handled by the queue."""
+        if not isinstance(user_id, int) or not isinstance(item_id, int):
+            return jsonify({"error": "Ids must be integers"}), 400
+        if not self.enqueue(kind, user_id, item_id, op):
+            self._count("rejected")
+            self._wake.set()
+            return jsonify({"error": "Too many favorite changes waiting, try again later"}), 503, {"Retry-After": "1"}
+        return jsonify({"message": "Favorite change queued", "queued": True}), 202
+
+    # flushing
+
+    @property
+    def owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _take_lease(self):
+        now = time.time()
+        return self.journal().execute(
+            "UPDATE flush_lease SET owner = ?, expires_at = ? WHERE id = 1 AND (owner IS NULL OR owner = ? OR expires_at < ?)",
+            (self.owner, now + LEASE_SECONDS, self.owner, now)).rowcount == 1
+
+    def _release_lease(self):
+        self.journal().execute("UPDATE flush_lease SET owner = NULL WHERE id = 1 AND owner = ?", (self.owner,))
+
+    def flush(self):
+        """Applies the journal in batches until it is empty; None when another worker holds the lease."""
+        with self._flush_lock:
+            if not self._take_lease():
+                return None
+            applied = 0
+            try:
+                while True:
+                    entries = self.journal().execute(
+                        "SELECT seq, kind, user_id, item_id, op FROM favorite_ops ORDER BY seq LIMIT ?",
+                        (self.batch_size,)).fetchall()
+                    if not entries:
+                        break
+                    self.apply(entries)
+                    self.journal().execute("DELETE FROM favorite_ops WHERE seq <= ?", (entries[-1][0],))
+                    applied += len(entries)
+                    if len(entries) < self.batch_size or not self._take_lease():
+                        break
+            finally:
+                self._release_lease()
+            self._count("flushed", applied)
+            return applied
+
+    def apply(self, entries):
+        latest = {}
+        for _, kind, user_id, item_id, op in entries:
+            latest[(kind, user_id, item_id)] = op
+        self._count("coalesced", len(entries) - len(latest))
+        try:
+            self.write(latest)
+        except IntegrityError:
+            # a user or item deleted since the checks in write(): apply one by one, dropping what still fails
+            db.session.rollback()
+            for key, op in latest.items():
+                try:
+                    self.write({key: op})
+                except IntegrityError:
+                    db.session.rollback()
+                    self._count("dropped")
+                    self.app.logger.warning("dropped queued favorite %s %s", op, key)
+
+    def write(self, latest):
+        """Brings every (kind, user, item) in latest to its state in one transaction."""
+        users = existing(User.id, [user_id for (_, user_id, _), op in latest.items() if op == ADD])
+        touched = False
+        for kind, (favorite_model, target_model, key) in KINDS.items():
+            adds = [(user_id, item_id) for (k, user_id, item_id), op in latest.items() if k == kind and op == ADD]
+            removes = [(user_id, item_id) for (k, user_id, item_id), op in latest.items() if k == kind and op == REMOVE]
+            targets = existing(target_model.id, [item_id for _, item_id in adds])
+            rows = [{"user_id": user_id, key: item_id} for user_id, item_id in adds
+                    if user_id in users and item_id in targets]
+            self._count("dropped", len(adds) - len(rows))
+            if rows:
+                db.session.execute(insert_or_revive(db.engine.dialect.name, favorite_model, "user_id", key), rows)
+            if removes:
+                pair = tuple_(favorite_model.user_id, getattr(favorite_model, key))
+                db.session.execute(update(favorite_model)
+                                   .where(pair.in_(removes), favorite_model.deleted_at.is_(None))
+                                   .values(deleted_at=func.now()))
+            items = {row[key] for row in rows} | {item_id for _, item_id in removes}
+            if items:
+                recount(target_model, items)
+                touched = True
+        db.session.commit()
+        if touched:
+            popularity.mark_stale()
+
+    def start(self):
+        if self._pid == os.getpid() or self._stopping.is_set():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="favorites-write-behind", daemon=True)
+                self._thread.start()
+                # the safety net when nothing calls drain() first, e.g. under flask run or uvicorn
+                atexit.register(self.drain)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                # the entries stay in the journal for the next round
+                self.app.logger.exception("flushing queued favorites failed")
+
+    def drain(self, timeout=None):
+        """Stops the flusher and applies everything queued, waiting for another worker's flush if need be."""
+        if not self.enabled:
+            return True
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(self.flush_interval + 5)
+        deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+        with self.app.app_context():
+            while self.pending():
+                if time.monotonic() > deadline:
+                    self.app.logger.warning("%d queued favorites left in %s", self.pending(), self.path)
+                    return False
+                if self.flush() is None:
+                    time.sleep(0.1)
+        return True
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "pending": self.pending(),
+            "queued": self.queued,
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+favorites_queue = FavoritesQueue()
+
+cli = AppGroup("favorites", help="Write-behind queue for favorite changes")
+
+
+@cli.command("drain")
+def drain_command():
+    """Apply every queued favorite change now."""
+    if not favorites_queue.enabled:
+        click.echo("FAVORITES_WRITE_BEHIND is off, nothing is queued")
+        return
+    pending = favorites_queue.pending()
+    if favorites_queue.drain():
+        click.echo(f"{pending} queued changes applied")
+    else:
+        click.echo(f"{favorites_queue.pending()} queued changes are still waiting")
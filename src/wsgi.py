@@ -1,7 +1,10 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
-from app import app as application
+from app import create_app
+
+# built once in the gunicorn master with --preload, the workers inherit it and connect after the fork
+application = create_app()
 
 if __name__ == "__main__":
     application.run()
@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from app import create_app
+from models import db, People
+from search import name_search, NameIndex
+
+
+def test_admin_edit_changes_the_cached_people_list(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'admin.db'}",
+        "ADMIN_ENABLED": True,
+        "CACHE_ENABLED": True,
+        "RATE_LIMIT_ENABLED": False,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.session.add(People(name="Luke Skywalker", height=172, mass=77))
+        db.session.commit()
+    name_search.index = NameIndex()
+    client = app.test_client()
+
+    before = client.get("/people")
+    etag = before.headers["ETag"]
+    assert client.get("/people", headers={"If-None-Match": etag}).status_code == 304
+    assert [item["name"] for item in client.get("/search?q=luke").get_json()["results"]] == ["Luke Skywalker"]
+
+    edited = client.post("/admin/people/edit/?id=1", data={"name": "Luke Organa", "height": "172", "mass": "77"})
+    assert edited.status_code == 302
+
+    after = client.get("/people", headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != etag
+    assert [item["name"] for item in after.get_json()["people"]] == ["Luke Organa"]
+    assert [item["name"] for item in client.get("/search?q=luke").get_json()["results"]] == ["Luke Organa"]
+    assert client.get("/search?q=skywalker").get_json()["results"] == []
+
+    deleted = client.post("/admin/people/delete/", data={"id": "1"})
+    assert deleted.status_code == 302
+    assert client.get("/people").get_json()["people"] == []
+    assert client.get("/search?q=luke").get_json()["results"] == []
@@ -0,0 +1,54 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from app import create_app
+from models import db, User, People
+
+
+def make_app(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'bulk.db'}",
+        "ADMIN_ENABLED": False,
+        "RATE_LIMIT_ENABLED": False,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+    return app
+
+
+def test_bad_rows_are_reported_on_their_own(tmp_path):
+    app = make_app(tmp_path)
+    response = app.test_client().post("/people/bulk", json=[
+        {"name": "Luke Skywalker", "height": 172, "mass": 77},
+        {"name": "Leia Organa", "height": "tall", "mass": 49},
+        {"name": ["Han", "Solo"], "height": 180, "mass": 80},
+        {"name": "Chewbacca", "height": 228, "mass": True},
+        {"name": "x" * 101, "height": 1, "mass": 1},
+        {"name": "Yoda", "height": 66, "mass": 17},
+    ])
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body["created"] == 2
+    assert [result["status"] for result in body["results"]] == \
+        ["created", "error", "error", "error", "error", "created"]
+    assert body["results"][1]["error"] == "height must be an integer"
+    assert body["results"][2]["error"] == "name must be a string of at most 100 characters"
+    with app.app_context():
+        assert sorted(name for (name,) in db.session.query(People.name)) == ["Luke Skywalker", "Yoda"]
+
+
+def test_non_integer_favorite_ids_are_reported_on_their_own(tmp_path):
+    app = make_app(tmp_path)
+    with app.app_context():
+        db.session.add_all([User(username="luke", email="luke@example.com", password="x"),
+                            People(name="Yoda", height=66, mass=17)])
+        db.session.commit()
+    response = app.test_client().post("/favorites/bulk", json=[
+        {"user_id": [1], "people_id": 1},
+        {"user_id": 1, "people_id": {"id": 1}},
+        {"user_id": 1, "people_id": 1},
+    ])
+    assert response.status_code == 207
+    assert [result["status"] for result in response.get_json()["results"]] == ["error", "error", "created"]
@@ -0,0 +1,37 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from app import create_app
+from models import db, User, People
+
+
+def test_idempotency_keys_are_scoped_by_caller(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'idempotency.db'}",
+        "ADMIN_ENABLED": False,
+        "RATE_LIMIT_ENABLED": False,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.session.add_all([User(username="luke", email="luke@example.com", password="x"),
+                            User(username="leia", email="leia@example.com", password="x"),
+                            People(name="Yoda", height=66, mass=17)])
+        db.session.commit()
+    luke = app.test_client()
+    luke.environ_base["REMOTE_ADDR"] = "10.0.0.1"
+    leia = app.test_client()
+    leia.environ_base["REMOTE_ADDR"] = "10.0.0.2"
+    headers = {"Idempotency-Key": "1"}
+
+    first = luke.post("/favorite/people", json={"user_id": 1, "people_id": 1}, headers=headers)
+    assert first.status_code == 201
+    # another client picking the same key runs its own request
+    other = leia.post("/favorite/people", json={"user_id": 2, "people_id": 1}, headers=headers)
+    assert other.status_code == 201
+    assert "Idempotent-Replayed" not in other.headers
+    # the same client retrying gets its first response back
+    retry = luke.post("/favorite/people", json={"user_id": 1, "people_id": 1}, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from flask import g
+from app import create_app
+from database import router
+from models import db, People
+
+
+def make_app(tmp_path, replica_url):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'primary.db'}",
+        "SQLALCHEMY_BINDS": {"replica_0": replica_url},
+        "ADMIN_ENABLED": False,
+        "CACHE_ENABLED": False,
+        "RATE_LIMIT_ENABLED": False,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.session.add(People(name="Primary", height=1, mass=1))
+        db.session.commit()
+    return app
+
+
+def add_replica(app):
+    # the replica is a file of its own, the same row under another name tells the two apart
+    with app.app_context():
+        engine = db.engines["replica_0"]
+        db.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(People.__table__.insert().values(id=1, name="Replica", height=1, mass=1,
+                                                                row_version=1))
+
+
+def test_reads_go_to_the_replica(tmp_path):
+    app = make_app(tmp_path, f"sqlite:///{tmp_path / 'replica.db'}")
+    add_replica(app)
+    assert app.test_client().get("/people/1").get_json()["person"]["name"] == "Replica"
+
+
+def test_a_request_stays_on_the_primary_after_it_writes(tmp_path):
+    app = make_app(tmp_path, f"sqlite:///{tmp_path / 'replica.db'}")
+    add_replica(app)
+    with app.test_request_context():
+        g.db_replica = "replica_0"
+        assert db.session.get(People, 1).name == "Replica"
+        db.session.add(People(name="Written", height=1, mass=1))
+        db.session.flush()
+        db.session.expunge_all()
+        assert sorted(name for (name,) in db.session.query(People.name)) == ["Primary", "Written"]
+        db.session.rollback()
+
+
+def test_a_failing_replica_falls_back_to_the_primary(tmp_path):
+    app = make_app(tmp_path, f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    response = app.test_client().get("/people/1")
+    assert response.status_code == 200
+    assert response.get_json()["person"]["name"] == "Primary"
+    # the replica is left out until it has had time to come back
+    assert router.pick() is None
@@ -0,0 +1,45 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from app import create_app
+from models import db, People, Planets
+from search import name_search, NameIndex
+
+
+def test_concurrent_first_searches_build_the_index_once(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'search.db'}",
+        "ADMIN_ENABLED": False,
+        "RATE_LIMIT_ENABLED": False,
+    })
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.session.add_all([
+            People(name="Luke Skywalker", height=172, mass=77),
+            People(name="Lumiya", height=170, mass=60),
+            Planets(name="Lothal", orbital_period=333, population=1000),
+        ])
+        db.session.commit()
+    name_search.index = NameIndex()
+
+    barrier = threading.Barrier(8)
+    results = []
+
+    def search():
+        client = app.test_client()
+        barrier.wait()
+        results.append(client.get("/search?q=lu").get_json()["results"])
+
+    threads = [threading.Thread(target=search) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    names = {"Luke Skywalker", "Lumiya"}
+    assert all({item["name"] for item in found} == names for found in results)
+    # the index is still whole once every request is done
+    assert {item["name"] for item in app.test_client().get("/search?q=lu").get_json()["results"]} == names